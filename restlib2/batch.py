@@ -0,0 +1,201 @@
+import base64
+import logging
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connections
+from django.http import HttpResponse
+from .http import codes, methods
+from .resources import Resource
+from .serializers import serializers
+
+try:
+    str = unicode
+except NameError:
+    pass
+
+# Request headers that describe the batch request entity itself. These are
+# never copied from the outer request onto a sub-request.
+ENTITY_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_IF_MATCH',
+                  'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+                  'HTTP_IF_UNMODIFIED_SINCE', 'HTTP_RANGE', 'HTTP_IF_RANGE')
+
+# Attributes set on the outer request by middleware (which does not run for
+# sub-requests) that are shared with each sub-request.
+SHARED_ATTRIBUTES = ('user', 'session')
+
+logger = logging.getLogger(__name__)
+
+
+class SubRequestError(ValueError):
+    "Raised when a sub-request description is not valid."
+
+
+# ## Batch Resource
+# Accepts a JSON array of sub-requests and dispatches each one to the
+# resource its `path` resolves to. Each sub-request is an object with a
+# `path` and optionally a `method` (defaults to `GET`), `headers` and
+# `body`. The response is an array of objects in the same order with the
+# `status`, `headers` and `body` of the corresponding sub-response. The
+# headers include `ETag` and `Last-Modified` when set, so clients can send
+# conditional sub-requests, e.g. with an `If-None-Match` header, and get
+# back a `304` status for items that have not changed. Bodies that are not
+# text are base64 encoded and the item has an `encoding` of `base64`.
+class BatchResource(Resource):
+    supported_accept_types = ('application/json',)
+
+    # Maximum number of sub-requests accepted in a single batch.
+    max_batch_size = 50
+
+    # Maximum number of sub-requests dispatched at the same time. The
+    # default processes them sequentially in the request thread.
+    max_concurrency = 1
+
+    def post(self, request):
+        items = getattr(request, 'data', None)
+
+        if not isinstance(items, list):
+            return HttpResponse(status=codes.unprocessable_entity)
+
+        if len(items) > self.max_batch_size:
+            return HttpResponse(status=codes.request_entity_too_large)
+
+        try:
+            subrequests = [self.build_subrequest(request, item)
+                           for item in items]
+        except SubRequestError as e:
+            return HttpResponse(str(e), status=codes.unprocessable_entity,
+                                content_type='text/plain')
+
+        concurrency = min(self.max_concurrency or 1, len(subrequests))
+
+        if concurrency <= 1:
+            return [self.dispatch_subrequest(r) for r in subrequests]
+
+        pool = ThreadPool(concurrency)
+
+        try:
+            return pool.map(self._dispatch_threaded, subrequests)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _dispatch_threaded(self, request):
+        try:
+            return self.dispatch_subrequest(request)
+        finally:
+            # Each worker thread has its own database connections which
+            # would otherwise be left open.
+            for connection in connections.all():
+                connection.close()
+
+    # Builds a `WSGIRequest` for a single batch item. The environment of the
+    # outer request is used as a base so the server and client details are
+    # retained.
+    def build_subrequest(self, request, item):
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('path'), (str, bytes)):
+            raise SubRequestError('Each sub-request requires a path')
+
+        method = str(item.get('method') or methods.GET).upper()
+        headers = item.get('headers') or {}
+
+        if method not in methods:
+            raise SubRequestError('Unsupported method {0}'.format(method))
+
+        if not isinstance(headers, dict):
+            raise SubRequestError('Sub-request headers must be an object')
+
+        path, _, query = str(item['path']).partition('?')
+
+        environ = dict((key, value) for key, value in request.META.items()
+                       if key not in ENTITY_HEADERS)
+
+        body = item.get('body')
+
+        # The `Content-Type` header of the item takes precedence
+        if body is None:
+            body = b''
+        elif isinstance(body, (str, bytes)):
+            environ['CONTENT_TYPE'] = 'text/plain'
+        else:
+            body = serializers.encode('application/json', body)
+            environ['CONTENT_TYPE'] = 'application/json'
+
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        for key, value in headers.items():
+            key = str(key).upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = str(value)
+
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+        })
+
+        subrequest = WSGIRequest(environ)
+
+        for attr in SHARED_ATTRIBUTES:
+            if hasattr(request, attr):
+                setattr(subrequest, attr, getattr(request, attr))
+
+        return subrequest
+
+    # Resolves the sub-request path and dispatches it to the matching
+    # resource. Only `Resource` instances are dispatched since sub-requests
+    # bypass the middleware a plain view may rely on.
+    def dispatch_subrequest(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            match = None
+
+        if match is None or not isinstance(match.func, Resource) or \
+                isinstance(match.func, BatchResource):
+            return self.encode_subresponse(
+                request, HttpResponse(status=codes.not_found))
+
+        # A failing sub-request does not fail the other ones
+        try:
+            response = match.func(request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception('Error dispatching sub-request')
+            response = HttpResponse(status=codes.internal_server_error)
+
+        return self.encode_subresponse(request, response)
+
+    # Converts a sub-response into the batch item representation. JSON
+    # bodies are embedded as-is, other bodies are included as text or, if
+    # they cannot be decoded, base64 encoded.
+    def encode_subresponse(self, request, response):
+        item = {
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'headers': dict(response.items()),
+            'body': None,
+        }
+
+        if getattr(response, 'streaming', False) or not response.content:
+            return item
+
+        try:
+            body = response.content.decode(response._charset)
+        except UnicodeDecodeError:
+            item['body'] = base64.b64encode(response.content).decode('ascii')
+            item['encoding'] = 'base64'
+            return item
+
+        content_type = response.get('Content-Type', '').split(';')[0]
+
+        if content_type == 'application/json':
+            body = serializers.decode(content_type, body)
+
+        item['body'] = body
+        return item
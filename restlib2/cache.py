@@ -0,0 +1,437 @@
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+import six
+
+try:
+    from django.core.cache.backends.base import DEFAULT_TIMEOUT
+# Django < 1.6 uses `None` for the default timeout
+except ImportError:
+    DEFAULT_TIMEOUT = None
+
+# ETags are unique values, so they can be cached for a long time
+MAX_CACHE_AGE = 60 * 60 * 24 * 30
+
+# Marks a key known to be missing from the shared cache
+MISSING = object()
+
+
+def freeze_response(response, expires):
+    "Returns a picklable representation of a response for caching."
+    return {
+        'status': response.status_code,
+        'headers': list(response.items()),
+        'content': response.content,
+        'expires': expires,
+    }
+
+
+def thaw_response(entry):
+    "Restores a response from an entry created by `freeze_response`."
+    from django.http import HttpResponse
+
+    response = HttpResponse(entry['content'], status=entry['status'])
+
+    for header, value in entry['headers']:
+        response[header] = value
+
+    return response
+
+
+class LRUCache(object):
+    """Bounded in-process cache with per-entry expiry. Entries are kept in a
+    doubly linked list ordered by use so the least recently used entry can
+    be evicted in constant time.
+    """
+    # Positions within an entry
+    PREV, NEXT, KEY, VALUE, EXPIRES = range(5)
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unlink(self, entry):
+        entry[self.PREV][self.NEXT] = entry[self.NEXT]
+        entry[self.NEXT][self.PREV] = entry[self.PREV]
+
+    def _link(self, entry):
+        root = self._root
+        last = root[self.PREV]
+        entry[self.PREV], entry[self.NEXT] = last, root
+        last[self.NEXT] = root[self.PREV] = entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            if entry[self.EXPIRES] <= time.time():
+                self._unlink(entry)
+                del self._entries[key]
+                return default
+
+            self._unlink(entry)
+            self._link(entry)
+            return entry[self.VALUE]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None:
+                self._unlink(entry)
+
+            entry = [None, None, key, value, time.time() + timeout]
+            self._entries[key] = entry
+            self._link(entry)
+
+            while len(self._entries) > self.max_size:
+                oldest = self._root[self.NEXT]
+                self._unlink(oldest)
+                del self._entries[oldest[self.KEY]]
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None:
+                self._unlink(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None, None]
+
+
+class TieredCache(object):
+    """Two-tier cache with a bounded in-process LRU in front of a Django
+    cache. Reads are served from the local tier for up to `local_timeout`
+    seconds, after which the shared cache is consulted again. Keys missing
+    from the shared cache are remembered for `negative_timeout` seconds so
+    repeated lookups of unknown keys, e.g. ETags, also stay in-process.
+    Set it to 0 to disable negative caching.
+
+    Writes go to both tiers. Values in the local tier are shared between
+    threads and must not be mutated.
+
+    Implements the subset of the Django cache API used by restlib2 and
+    keeps `hits`, `misses` and `negative_hits` counters of the local tier.
+    """
+    def __init__(self, cache=None, max_size=1000, local_timeout=5,
+                 negative_timeout=1):
+        if cache is None:
+            from django.core.cache import cache
+        self.cache = cache
+        self.local = LRUCache(max_size)
+        self.local_timeout = local_timeout
+        self.negative_timeout = negative_timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    @property
+    def hit_rate(self):
+        "Fraction of reads served by the local tier."
+        total = self.hits + self.misses + self.negative_hits
+        if not total:
+            return 0.0
+        return (self.hits + self.negative_hits) / float(total)
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(self.local_timeout, timeout)
+
+    def _store(self, key, value):
+        if value is MISSING:
+            if self.negative_timeout:
+                self.local.set(key, MISSING, self.negative_timeout)
+        else:
+            self.local.set(key, value, self.local_timeout)
+
+    def get(self, key, default=None):
+        value = self.local.get(key, None)
+
+        if value is MISSING:
+            self.negative_hits += 1
+            return default
+
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = self.cache.get(key, MISSING)
+        self._store(key, value)
+
+        if value is MISSING:
+            return default
+        return value
+
+    def get_many(self, keys):
+        values = {}
+        misses = []
+
+        for key in keys:
+            value = self.local.get(key, None)
+
+            if value is MISSING:
+                self.negative_hits += 1
+            elif value is not None:
+                self.hits += 1
+                values[key] = value
+            else:
+                self.misses += 1
+                misses.append(key)
+
+        if misses:
+            found = self.cache.get_many(misses)
+
+            for key in misses:
+                self._store(key, found.get(key, MISSING))
+
+            values.update(found)
+
+        return values
+
+    def has_key(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __contains__(self, key):
+        return self.has_key(key)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self.cache.set(key, value, timeout)
+        self.local.set(key, value, self._local_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT):
+        self.cache.set_many(data, timeout)
+
+        for key, value in data.items():
+            self.local.set(key, value, self._local_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        added = self.cache.add(key, value, timeout)
+
+        # The current value is unknown if the key already existed
+        if added:
+            self.local.set(key, value, self._local_timeout(timeout))
+        else:
+            self.local.delete(key)
+
+        return added
+
+    # Counters are changed by other processes, so they are never served
+    # from the local tier.
+    def incr(self, key, delta=1):
+        self.local.delete(key)
+        return self.cache.incr(key, delta)
+
+    def decr(self, key, delta=1):
+        self.local.delete(key)
+        return self.cache.decr(key, delta)
+
+    def delete(self, key):
+        self.cache.delete(key)
+        self.local.delete(key)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+        for key in keys:
+            self.local.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+        self.local.clear()
+
+
+class EtagRegistry(object):
+    """Keeps track of the ETags handed out to clients so conditional requests
+    can be validated with a cache lookup.
+
+    Registering the same ETag over and over, as happens for every request
+    to a popular resource, only results in a single cache write. Keys that
+    have been registered within the last `seen_timeout` seconds are kept in
+    a bounded in-process set and are skipped. New keys are buffered and
+    written with a single `set_many` call once `flush_size` keys are
+    pending or at most `flush_interval` seconds after the first of them was
+    buffered, by a timer thread if no other key is registered meanwhile.
+    Keys seen by this process, including pending ones, are validated
+    without a cache lookup.
+    """
+    def __init__(self, timeout=MAX_CACHE_AGE, max_size=10000,
+                 seen_timeout=60 * 60, flush_size=20, flush_interval=1):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.seen_timeout = seen_timeout
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        # Registration time by key and the keys in registration order for
+        # evicting the oldest ones. A key registered again is evicted based
+        # on its latest entry.
+        self._seen = {}
+        self._order = deque()
+        # Pending keys by the cache they are written to
+        self._pending = {}
+        self._flushed = time.time()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _is_seen(self, key, now):
+        seen = self._seen.get(key)
+        return seen is not None and now - seen < self.seen_timeout
+
+    def register(self, cache, key):
+        now = time.time()
+
+        with self._lock:
+            if self._is_seen(key, now):
+                return
+
+            self._seen[key] = now
+            self._order.append((key, now))
+
+            while len(self._order) > self.max_size:
+                old_key, seen = self._order.popleft()
+                if self._seen.get(old_key) == seen:
+                    del self._seen[old_key]
+
+            self._pending.setdefault(cache, {})[key] = 1
+            size = sum(len(keys) for keys in self._pending.values())
+
+            if size < self.flush_size and \
+                    now - self._flushed < self.flush_interval:
+                # Writes the keys even if no other key is registered
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval,
+                                                  self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+            pending = self._take_pending(now)
+
+        self._write(pending)
+
+    def flush(self):
+        "Writes all pending keys to their caches."
+        with self._lock:
+            pending = self._take_pending(time.time())
+
+        self._write(pending)
+
+    # Must be called with the lock held
+    def _take_pending(self, now):
+        pending, self._pending = self._pending, {}
+        self._flushed = now
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        return pending
+
+    def _write(self, pending):
+        for cache, keys in pending.items():
+            cache.set_many(keys, self.timeout)
+
+    def registered(self, cache, keys):
+        """Returns the subset of the keys that are registered. Keys not
+        seen by this process are looked up with a single `get_many`.
+        """
+        now = time.time()
+
+        with self._lock:
+            found = set(key for key in keys if self._is_seen(key, now))
+
+        missing = [key for key in keys if key not in found]
+
+        if missing:
+            found.update(cache.get_many(missing))
+
+        return found
+
+    def is_registered(self, cache, key):
+        with self._lock:
+            if self._is_seen(key, time.time()):
+                return True
+
+        return key in cache
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key within the process. The
+    first caller executes the function and callers arriving while it is in
+    flight wait for it and share its result, or exception. `executions`
+    counts the calls that were executed and `saved` the ones that shared
+    the result of another call.
+    """
+    # Positions within a call
+    DONE, RESULT, ERROR = range(3)
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.executions = 0
+        self.saved = 0
+
+    def do(self, key, func):
+        """Returns the result of `func` and whether it was shared with
+        another call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+                self.executions += 1
+            else:
+                self.saved += 1
+
+        if not leader:
+            call[self.DONE].wait()
+
+            if call[self.ERROR] is not None:
+                six.reraise(*call[self.ERROR])
+
+            return call[self.RESULT], True
+
+        try:
+            call[self.RESULT] = func()
+        except Exception:
+            call[self.ERROR] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[self.DONE].set()
+
+        return call[self.RESULT], False
+
+
+etags = EtagRegistry()
+
+# Pending keys are written when the process exits rather than lost with
+# the flush timer
+atexit.register(etags.flush)
+
+# Recent representations of resources using delta encoding by ETag key
+representations = LRUCache(max_size=100)
+
+# Handler executions of resources coalescing requests
+coalescer = SingleFlight()
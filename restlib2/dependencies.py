@@ -0,0 +1,170 @@
+import time
+import hashlib
+from datetime import datetime, timedelta
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from . import events
+
+EPOCH_DATE = datetime(1970, 1, 1, 0, 0, 0)
+
+GENERATION_KEY = 'restlib2:generation:{0}'
+MODIFIED_KEY = 'restlib2:modified:{0}'
+
+# Generations are kept well beyond the lifetime of the entries that
+# depend on them
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def model_tag(model):
+    "Returns the tag for a model class or instance."
+    return '{0}.{1}'.format(model._meta.app_label,
+                            model._meta.object_name.lower())
+
+
+def instance_tag(model, pk=None):
+    """Returns the tag for a single model instance. Either takes an instance
+    or a model class and primary key.
+    """
+    if pk is None:
+        pk = model.pk
+    return '{0}:{1}'.format(model_tag(model), pk)
+
+
+class Tracker(object):
+    """Tracks changes to tags in a Django cache. For each tag a generation
+    counter and the time of the last modification are kept. A tag's
+    generation is bumped whenever data it represents changes. Cached
+    entries that include the generations of the tags they depend on are
+    implicitly invalidated when one of them is bumped.
+
+    Generations start at the current time in milliseconds rather than zero
+    so an evicted counter does not start over at a value that has been used
+    before. Tags that have not changed since they were first looked up
+    are considered modified at that time.
+    """
+    def __init__(self, cache=None):
+        self._cache = cache
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import cache
+            return cache
+        return self._cache
+
+    def get_many(self, tags):
+        """Returns the generation and last modified time, in seconds since
+        the epoch, by tag with a single cache look up.
+        """
+        keys = []
+
+        for tag in tags:
+            keys.append(GENERATION_KEY.format(tag))
+            keys.append(MODIFIED_KEY.format(tag))
+
+        found = self.cache.get_many(keys)
+        now = time.time()
+        state = {}
+
+        for tag in tags:
+            generation_key = GENERATION_KEY.format(tag)
+            modified_key = MODIFIED_KEY.format(tag)
+
+            if generation_key not in found:
+                generation = int(now * 1000)
+                if not self.cache.add(generation_key, generation,
+                                      GENERATION_TIMEOUT):
+                    generation = self.cache.get(generation_key, generation)
+                found[generation_key] = generation
+
+            if modified_key not in found:
+                modified = now
+                if not self.cache.add(modified_key, modified,
+                                      GENERATION_TIMEOUT):
+                    modified = self.cache.get(modified_key, modified)
+                found[modified_key] = modified
+
+            state[tag] = (found[generation_key], found[modified_key])
+
+        return state
+
+    def changed(self, tags):
+        """Bumps the generations and modification times of the tags and
+        publishes the change to the event broker.
+        """
+        now = time.time()
+
+        for tag in tags:
+            key = GENERATION_KEY.format(tag)
+
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, int(now * 1000), GENERATION_TIMEOUT)
+
+        self.cache.set_many(dict((MODIFIED_KEY.format(tag), now)
+                                 for tag in tags), GENERATION_TIMEOUT)
+
+        # Wake up requests in this process waiting for the tags to change
+        events.broker.publish(tags)
+
+    def state(self, tags):
+        """Returns a digest of the current generations of the tags and the
+        most recent modification time of any of them as a UTC datetime.
+        """
+        if not tags:
+            return '', None
+
+        state = self.get_many(tags)
+        parts = ['{0}={1}'.format(tag, state[tag][0])
+                 for tag in sorted(state)]
+        version = hashlib.md5(';'.join(parts).encode('utf-8')).hexdigest()
+
+        modified = max(modified for _, modified in state.values())
+        modified = EPOCH_DATE + timedelta(seconds=modified)
+
+        return version, modified
+
+
+tracker = Tracker()
+
+# Tags of the models that have been registered
+registered = set()
+
+
+def _model_changed(sender, instance, **kwargs):
+    tracker.changed([model_tag(sender), instance_tag(instance)])
+
+
+def _m2m_changed(sender, instance, action, model, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if model_tag(instance) not in registered and \
+            model_tag(model) not in registered:
+        return
+
+    # Both sides of the relationship are affected
+    tags = [model_tag(instance), instance_tag(instance), model_tag(model)]
+
+    if pk_set:
+        tags.extend(instance_tag(model, pk) for pk in pk_set)
+
+    tracker.changed(tags)
+
+
+def register(model):
+    """Tracks changes to the model so its tags are marked as changed on
+    `post_save`, `post_delete` and `m2m_changed` signals. Registering a model
+    more than once has no effect.
+    """
+    tag = model_tag(model)
+    uid = 'restlib2:{0}'.format(tag)
+
+    post_save.connect(_model_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(_model_changed, sender=model, dispatch_uid=uid)
+
+    # Relationship changes are filtered by the registered models in the
+    # handler since through models may not be resolved yet.
+    m2m_changed.connect(_m2m_changed, dispatch_uid='restlib2')
+
+    registered.add(tag)
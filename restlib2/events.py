@@ -0,0 +1,90 @@
+import threading
+
+
+class Subscription(object):
+    """Subscription to a set of tags. Published tags are collected until
+    they are consumed by `wait`. Use as a context manager or call `close`
+    to unsubscribe.
+    """
+    def __init__(self, broker, tags):
+        self.broker = broker
+        self.tags = set(tags)
+        self.changed = set()
+        self.event = threading.Event()
+
+    def wait(self, timeout=None):
+        """Blocks until one of the tags is published or the timeout passes.
+        Returns the tags published since the last call, if any.
+        """
+        self.event.wait(timeout)
+
+        with self.broker._lock:
+            changed, self.changed = self.changed, set()
+            self.event.clear()
+
+        return changed
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Broker(object):
+    """In-process publish/subscribe of changes keyed by tags, e.g. the cache
+    tags of `restlib2.dependencies` which are published when a tracked model
+    changes. Only the subscriptions of a published tag are woken up, so many
+    idle subscribers are cheap.
+
+    Changes made by other processes are not published. Those can be relayed
+    by calling `publish`, e.g. from a thread listening on a socket.
+    """
+    def __init__(self):
+        # Subscriptions by tag
+        self._subscriptions = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def sequence(self):
+        "Number of the last publish."
+        return self._sequence
+
+    def subscribe(self, tags):
+        subscription = Subscription(self, tags)
+
+        with self._lock:
+            for tag in subscription.tags:
+                self._subscriptions.setdefault(tag, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for tag in subscription.tags:
+                subscriptions = self._subscriptions.get(tag)
+
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+
+                    if not subscriptions:
+                        del self._subscriptions[tag]
+
+    def publish(self, tags):
+        "Notifies the subscribers of the tags. Returns the publish number."
+        with self._lock:
+            self._sequence += 1
+
+            for tag in tags:
+                for subscription in self._subscriptions.get(tag, ()):
+                    subscription.changed.add(tag)
+                    subscription.event.set()
+
+            return self._sequence
+
+
+broker = Broker()
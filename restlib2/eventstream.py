@@ -0,0 +1,115 @@
+import time
+from django.core.exceptions import ImproperlyConfigured
+from .events import broker
+from .resources import Resource, StreamingHttpResponse
+from .serializers import serializers
+
+
+def format_event(data=None, event=None, id=None, retry=None):
+    "Formats a message of the `text/event-stream` format."
+    lines = []
+
+    if event is not None:
+        lines.append('event: {0}'.format(event))
+
+    if id is not None:
+        lines.append('id: {0}'.format(id))
+
+    if retry is not None:
+        lines.append('retry: {0}'.format(retry))
+
+    if data is not None:
+        lines.extend('data: ' + line for line in data.splitlines() or [''])
+
+    return '\n'.join(lines) + '\n\n'
+
+
+# ## Event Stream Resource
+# Streams [server-sent events][0] to clients rather than having them poll
+# the resource. An event is sent when the stream is opened and whenever
+# one of the event tags of the resource is published, which defaults to
+# the tags of `cache_dependencies`. The data of an event is the JSON
+# encoded return value of `get_event`.
+#
+# Comments are sent every `heartbeat` seconds to keep the connection open
+# through proxies and to detect clients that went away. Streams are closed
+# after `stream_timeout` seconds and the client reconnects after `retry`
+# milliseconds. Each open stream holds a worker thread, so this requires a
+# threaded or asynchronous worker. Requires Django 1.5+.
+#
+# [0]: http://www.w3.org/TR/eventsource/
+class EventStreamResource(Resource):
+    supported_accept_types = ('text/event-stream',)
+
+    use_etags = False
+
+    # Number of seconds between keep-alive comments.
+    heartbeat = 15
+
+    # Number of seconds after which the stream is closed.
+    stream_timeout = 60 * 5
+
+    # Number of milliseconds clients wait before reconnecting.
+    retry = 3000
+
+    def __init__(self, **kwargs):
+        if StreamingHttpResponse is None:
+            raise ImproperlyConfigured('{0} requires Django 1.5+'
+                                       .format(self.__class__.__name__))
+        super(EventStreamResource, self).__init__(**kwargs)
+
+    # Returns the data of the event sent for the changed tags. The tags are
+    # empty for the event sent when the stream is opened. Return `None` to
+    # skip the event.
+    def get_event(self, request, tags, *args, **kwargs):
+        return {'tags': sorted(tags)}
+
+    def get(self, request, *args, **kwargs):
+        tags = self.get_event_tags(request, *args, **kwargs)
+
+        response = StreamingHttpResponse(
+            self.stream(request, tags, args, kwargs),
+            content_type='text/event-stream')
+
+        response['Cache-Control'] = 'no-cache'
+        # Disables response buffering by nginx
+        response['X-Accel-Buffering'] = 'no'
+
+        return response
+
+    def encode_event(self, request, tags, args, kwargs):
+        data = self.get_event(request, tags, *args, **kwargs)
+
+        if data is None:
+            return
+
+        data = serializers.encode('application/json', data)
+        return format_event(data, id=broker.sequence)
+
+    def stream(self, request, tags, args, kwargs):
+        subscription = broker.subscribe(tags)
+        deadline = time.time() + self.stream_timeout
+
+        try:
+            yield format_event(retry=self.retry)
+
+            event = self.encode_event(request, set(), args, kwargs)
+            if event is not None:
+                yield event
+
+            while True:
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    break
+
+                changed = subscription.wait(min(remaining, self.heartbeat))
+
+                if changed:
+                    event = self.encode_event(request, changed, args, kwargs)
+                    if event is not None:
+                        yield event
+                else:
+                    yield ': keep-alive\n\n'
+        finally:
+            subscription.close()
@@ -3,6 +3,9 @@ from restlib2.structures import AttrDict
 
 STATUS_CODE_TEXT.setdefault(422, 'UNPROCESSABLE ENTITY')
 
+# http://tools.ietf.org/html/rfc3229
+STATUS_CODE_TEXT.setdefault(226, 'IM USED')
+
 # http://tools.ietf.org/html/rfc6585
 STATUS_CODE_TEXT.setdefault(428, 'PRECONDITION REQUIRED')
 STATUS_CODE_TEXT.setdefault(429, 'TOO MANY REQUESTS')
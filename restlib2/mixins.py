@@ -1,7 +1,14 @@
 from django.template import loader
 from django.template import RequestContext
+from django.db.models import F
 from django.http import HttpResponse
+from django.utils.http import quote_etag
 from .http import codes
+from .dependencies import tracker, model_tag, instance_tag
+
+
+class PreconditionFailed(Exception):
+    "Raised when a conditional write loses the race with another write."
 
 
 class TemplateResponseMixin(object):
@@ -23,3 +30,87 @@ class TemplateResponseMixin(object):
         content = template.render(context)
 
         return HttpResponse(content, status=status, content_type=content_type)
+
+
+class VersionedResourceMixin(object):
+    """Optimistic concurrency control for resources representing a model
+    instance with an integer version column. The version is used as the
+    ETag, so `If-Match` preconditions are evaluated against it without
+    rendering the entity. Conditional requests are required by default.
+
+    Writes are performed with `update_version` which increments the version
+    with a compare-and-swap, `UPDATE ... WHERE version = N`, so no rows are
+    locked. If another write changed the row since the precondition was
+    checked, nothing is updated and a _412 Precondition Failed_ response is
+    returned. Together with `patch_document` only the changed fields are
+    written, e.g. `self.update_version(request, patch.changes(doc, fields),
+    **kwargs)`. Successful writes respond with the new version as the ETag,
+    so clients can make their next write without fetching the entity.
+
+    Since `QuerySet.update` does not send `post_save`, `update_version`
+    marks the model and instance tags as changed itself, so cached
+    responses depending on them are invalidated. Other writes made with
+    `update` must do the same with `dependencies.tracker.changed`.
+    """
+    model = None
+    version_field = 'version'
+
+    use_etags = True
+    require_conditional_request = True
+
+    # Returns the queryset of the requested instance. Defaults to filtering
+    # the model by the URL keyword arguments, e.g. `pk`.
+    def get_version_queryset(self, request, *args, **kwargs):
+        return self.model._default_manager.filter(**kwargs)
+
+    # The version is memoized on the request, so the precondition and the
+    # update are checked against the same version.
+    def get_version(self, request, *args, **kwargs):
+        if not hasattr(request, '_version'):
+            queryset = self.get_version_queryset(request, *args, **kwargs)
+            rows = list(queryset.values_list('pk', self.version_field)[:1])
+            # The primary key is kept for the tag of the instance
+            request._version_pk, request._version = \
+                rows[0] if rows else (None, None)
+        return request._version
+
+    def calculate_etag(self, request, *args, **kwargs):
+        version = self.get_version(request, *args, **kwargs)
+        if version is not None:
+            return str(version)
+
+    # Updates the instance with the values, a dict of field names and
+    # values, and increments the version if it has not changed. Returns the
+    # new version or raises `PreconditionFailed`.
+    def update_version(self, request, values, *args, **kwargs):
+        version = self.get_version(request, *args, **kwargs)
+
+        if version is None:
+            raise PreconditionFailed
+
+        queryset = self.get_version_queryset(request, *args, **kwargs)
+        values = dict(values)
+        values[self.version_field] = F(self.version_field) + 1
+
+        if not queryset.filter(**{self.version_field: version}) \
+                .update(**values):
+            raise PreconditionFailed
+
+        request._version = version + 1
+        request._version_updated = True
+
+        # `update` does not send `post_save`
+        tracker.changed([model_tag(self.model),
+                         instance_tag(self.model, request._version_pk)])
+
+        return request._version
+
+    def process_response(self, request, response):
+        response = super(VersionedResourceMixin, self).process_response(
+            request, response)
+
+        if getattr(request, '_version_updated', False) and \
+                200 <= response.status_code < 300:
+            response['ETag'] = quote_etag(str(request._version))
+
+        return response
@@ -0,0 +1,378 @@
+import copy
+import six
+
+try:
+    str = unicode
+except NameError:
+    pass
+
+JSON_PATCH = 'application/json-patch+json'
+MERGE_PATCH = 'application/merge-patch+json'
+
+
+class PatchError(ValueError):
+    "Raised when a patch document is not valid or cannot be applied."
+
+
+class PatchConflict(PatchError):
+    "Raised when a `test` operation of a JSON Patch fails."
+
+
+def parse_pointer(pointer):
+    "Parses a JSON Pointer (RFC 6901) into a list of reference tokens."
+    if not isinstance(pointer, six.string_types):
+        raise PatchError('Pointer must be a string')
+
+    if pointer == '':
+        return []
+
+    if not pointer.startswith('/'):
+        raise PatchError('Invalid pointer {0}'.format(pointer))
+
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in pointer[1:].split('/')]
+
+
+def _index(container, token, append=False):
+    "Resolves a reference token to a list index."
+    if append and token == '-':
+        return len(container)
+
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError('Invalid array index {0}'.format(token))
+
+    index = int(token)
+    limit = len(container) + 1 if append else len(container)
+
+    if index >= limit:
+        raise PatchError('Array index {0} out of range'.format(token))
+
+    return index
+
+
+def _resolve(document, tokens):
+    "Returns the value referenced by the tokens."
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchError('Member {0} does not exist'.format(token))
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[_index(document, token)]
+        else:
+            raise PatchError('Cannot reference {0} in a scalar'.format(token))
+
+    return document
+
+
+def _equal(a, b):
+    "JSON equality which, unlike Python, distinguishes booleans and numbers."
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+
+    if isinstance(a, dict) and isinstance(b, dict):
+        return set(a) == set(b) and all(_equal(a[k], b[k]) for k in a)
+
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+
+    return a == b
+
+
+class JSONPatch(object):
+    """Applies a JSON Patch (RFC 6902) to a document in place. The
+    operations are applied in order and each change is recorded in an undo
+    log. If any operation fails, the changes made so far are reverted
+    before the error is raised, so the document is either patched as a
+    whole or left untouched.
+    """
+    def __init__(self, operations):
+        if not isinstance(operations, list):
+            raise PatchError('Patch must be an array of operations')
+        self.operations = operations
+
+    # Top-level members changed by the operations. `None` if the whole
+    # document is replaced.
+    @property
+    def fields(self):
+        fields = set()
+
+        for operation in self.operations:
+            if operation.get('op') == 'test':
+                continue
+
+            paths = [operation.get('path')]
+
+            if operation.get('op') == 'move':
+                paths.append(operation.get('from'))
+
+            for path in paths:
+                tokens = parse_pointer(path)
+                if not tokens:
+                    return None
+                fields.add(tokens[0])
+
+        return fields
+
+    def apply(self, document):
+        self.document = document
+        self._undo = []
+
+        try:
+            for operation in self.operations:
+                self._apply(operation)
+        except Exception:
+            for undo in reversed(self._undo):
+                undo()
+            raise
+        finally:
+            del self._undo
+
+        return self.document
+
+    def _apply(self, operation):
+        if not isinstance(operation, dict):
+            raise PatchError('Operation must be an object')
+
+        op = operation.get('op')
+        method = getattr(self, '_op_{0}'.format(op), None)
+
+        if not isinstance(op, six.string_types) or method is None:
+            raise PatchError('Invalid operation {0}'.format(op))
+
+        tokens = parse_pointer(operation.get('path'))
+
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise PatchError('Operation {0} requires a value'.format(op))
+
+        if op in ('move', 'copy'):
+            if 'from' not in operation:
+                raise PatchError('Operation {0} requires from'.format(op))
+            operation = dict(operation,
+                             _from=parse_pointer(operation['from']))
+
+        method(tokens, operation)
+
+    def _set_root(self, value):
+        old = self.document
+        self.document = value
+        self._undo.append(lambda: setattr(self, 'document', old))
+
+    def _parent(self, tokens):
+        parent = _resolve(self.document, tokens[:-1])
+
+        if not isinstance(parent, (dict, list)):
+            raise PatchError('Cannot reference {0} in a scalar'
+                             .format(tokens[-1]))
+
+        return parent, tokens[-1]
+
+    def _add(self, tokens, value):
+        if not tokens:
+            return self._set_root(value)
+
+        parent, token = self._parent(tokens)
+
+        if isinstance(parent, list):
+            index = _index(parent, token, append=True)
+            parent.insert(index, value)
+            self._undo.append(lambda: parent.pop(index))
+        elif token in parent:
+            old = parent[token]
+            parent[token] = value
+            self._undo.append(lambda: parent.__setitem__(token, old))
+        else:
+            parent[token] = value
+            self._undo.append(lambda: parent.pop(token))
+
+    def _remove(self, tokens):
+        if not tokens:
+            raise PatchError('Cannot remove the document root')
+
+        parent, token = self._parent(tokens)
+
+        if isinstance(parent, list):
+            index = _index(parent, token)
+            value = parent.pop(index)
+            self._undo.append(lambda: parent.insert(index, value))
+        else:
+            if token not in parent:
+                raise PatchError('Member {0} does not exist'.format(token))
+            value = parent.pop(token)
+            self._undo.append(lambda: parent.__setitem__(token, value))
+
+        return value
+
+    def _op_add(self, tokens, operation):
+        self._add(tokens, operation['value'])
+
+    def _op_remove(self, tokens, operation):
+        self._remove(tokens)
+
+    def _op_replace(self, tokens, operation):
+        if tokens:
+            self._remove(tokens)
+        self._add(tokens, operation['value'])
+
+    def _op_move(self, tokens, operation):
+        source = operation['_from']
+
+        if tokens[:len(source)] == source and len(tokens) > len(source):
+            raise PatchError('Cannot move a value into one of its children')
+
+        if tokens != source:
+            self._add(tokens, self._remove(source))
+
+    def _op_copy(self, tokens, operation):
+        value = _resolve(self.document, operation['_from'])
+        self._add(tokens, copy.deepcopy(value))
+
+    def _op_test(self, tokens, operation):
+        if not _equal(_resolve(self.document, tokens), operation['value']):
+            raise PatchConflict('Test failed for {0}'
+                                .format(operation['path']))
+
+
+def apply_json_patch(document, operations):
+    """Applies a JSON Patch to the document and returns the patched document
+    along with the set of changed top-level members.
+    """
+    patch = JSONPatch(operations)
+    before = set(document) if isinstance(document, dict) else set()
+    document = patch.apply(document)
+    fields = patch.fields
+
+    if fields is None and isinstance(document, dict):
+        fields = before | set(document)
+
+    return document, fields
+
+
+def merge_patch(target, patch):
+    "Applies a JSON Merge Patch (RFC 7396) to the target in place."
+    if not isinstance(patch, dict):
+        return patch
+
+    if not isinstance(target, dict):
+        target = {}
+
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+
+    return target
+
+
+def apply_merge_patch(document, patch):
+    """Applies a JSON Merge Patch to the document and returns the patched
+    document along with the set of changed top-level members.
+    """
+    before = set(document) if isinstance(document, dict) else set()
+    document = merge_patch(document, patch)
+
+    if isinstance(patch, dict):
+        fields = set(patch)
+    elif isinstance(document, dict):
+        fields = before | set(document)
+    else:
+        fields = None
+
+    return document, fields
+
+
+def _escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _diff(source, target, path, operations):
+    if _equal(source, target):
+        return
+
+    if isinstance(source, dict) and isinstance(target, dict):
+        for key in sorted(source):
+            if key not in target:
+                operations.append({'op': 'remove',
+                                   'path': path + '/' + _escape(key)})
+
+        for key in sorted(target):
+            child = path + '/' + _escape(key)
+
+            if key in source:
+                _diff(source[key], target[key], child, operations)
+            else:
+                operations.append({'op': 'add', 'path': child,
+                                   'value': target[key]})
+
+    elif isinstance(source, list) and isinstance(target, list):
+        # Items are compared after trimming the common prefix and suffix
+        # so inserting or removing items does not shift all that follow.
+        size = min(len(source), len(target))
+        start = 0
+
+        while start < size and _equal(source[start], target[start]):
+            start += 1
+
+        end = 0
+
+        while end < size - start and \
+                _equal(source[-end - 1], target[-end - 1]):
+            end += 1
+
+        source = source[start:len(source) - end]
+        target = target[start:len(target) - end]
+        common = min(len(source), len(target))
+
+        for index in range(common):
+            _diff(source[index], target[index],
+                  '{0}/{1}'.format(path, start + index), operations)
+
+        for index in reversed(range(common, len(source))):
+            operations.append({'op': 'remove',
+                               'path': '{0}/{1}'.format(path, start + index)})
+
+        for index in range(common, len(target)):
+            operations.append({'op': 'add',
+                               'path': '{0}/{1}'.format(path, start + index),
+                               'value': target[index]})
+
+    else:
+        operations.append({'op': 'replace', 'path': path, 'value': target})
+
+
+def diff(source, target):
+    """Returns the JSON Patch operations that transform the source document
+    into the target document. Unchanged members and items are skipped.
+    """
+    operations = []
+    _diff(source, target, '', operations)
+    return operations
+
+
+# Patch functions by content type
+PATCH_TYPES = {
+    JSON_PATCH: apply_json_patch,
+    MERGE_PATCH: apply_merge_patch,
+}
+
+
+def apply_patch(content_type, document, patch):
+    """Applies a patch document of the given content type. Returns the
+    patched document and the set of top-level members that changed, or
+    `None` if the document is not an object.
+    """
+    if content_type not in PATCH_TYPES:
+        raise PatchError('Unsupported patch type {0}'.format(content_type))
+
+    return PATCH_TYPES[content_type](document, patch)
+
+
+def changes(document, fields):
+    """Returns the values of the changed top-level members suitable for a
+    partial update, e.g. `Model.objects.filter(pk=pk).update(**changes)`.
+    Removed members are set to `None`. Note `update` does not send
+    `post_save`, so call `dependencies.tracker.changed` with the tags of
+    the instance for cached responses to be invalidated.
+    """
+    return dict((field, document.get(field)) for field in fields or ())
@@ -0,0 +1,231 @@
+import math
+import time
+import threading
+
+
+class RateLimit(object):
+    "The outcome of a single rate limit check."
+    def __init__(self, allowed, limit, remaining, reset):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Unix timestamp when the current window ends
+        self.reset = reset
+
+    @property
+    def retry_after(self):
+        "Number of seconds until the client should retry."
+        return max(1, int(math.ceil(self.reset - time.time())))
+
+
+class RateLimiter(object):
+    """Sliding window counter. Hits are counted in fixed windows of
+    `seconds` and the count of the previous window is weighted by how much
+    of it still overlaps the sliding window. This smooths out bursts at
+    window boundaries while only requiring two counters per client.
+
+    Subclasses implement `incr` and `get` for the counter storage.
+    """
+    key_prefix = 'restlib2:ratelimit'
+
+    def incr(self, key, timeout):
+        "Atomically increments the counter for `key` and returns the value."
+        raise NotImplementedError
+
+    def get(self, key):
+        "Returns the current value of the counter for `key`."
+        raise NotImplementedError
+
+    def make_key(self, key, window):
+        return '{0}:{1}:{2}'.format(self.key_prefix, key, window)
+
+    def hit(self, key, limit, seconds):
+        now = time.time()
+        window = int(now // seconds)
+
+        # Counters are kept for two windows since the previous window is
+        # still used to weight the current one.
+        current = self.incr(self.make_key(key, window), seconds * 2)
+        previous = self.get(self.make_key(key, window - 1)) or 0
+
+        elapsed = now - window * seconds
+        count = previous * (1 - elapsed / float(seconds)) + current
+
+        return RateLimit(allowed=count <= limit, limit=limit,
+                         remaining=max(0, int(limit - count)),
+                         reset=(window + 1) * seconds)
+
+
+class CacheRateLimiter(RateLimiter):
+    """Rate limiter backed by a Django cache. Counters are created with
+    `add` and incremented with `incr` which are atomic for the memcached and
+    database backends, so the limit is shared across processes and hosts.
+    """
+    def __init__(self, cache=None):
+        if cache is None:
+            from django.core.cache import cache
+        self.cache = cache
+
+    def incr(self, key, timeout):
+        if self.cache.add(key, 1, timeout):
+            return 1
+
+        try:
+            return self.cache.incr(key)
+        # The key expired or was evicted between `add` and `incr`
+        except ValueError:
+            self.cache.set(key, 1, timeout)
+            return 1
+
+    def get(self, key):
+        return self.cache.get(key)
+
+
+class LocalRateLimiter(RateLimiter):
+    """In-process rate limiter for single node deployments. Counters are
+    kept in a dict guarded by a lock and expired windows are pruned at most
+    once every `prune_interval` seconds.
+    """
+    prune_interval = 1
+
+    def __init__(self):
+        self._counters = {}
+        self._expires = {}
+        self._pruned = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        if now - self._pruned < self.prune_interval:
+            return
+
+        self._pruned = now
+
+        for key, expires in list(self._expires.items()):
+            if expires <= now:
+                self._counters.pop(key, None)
+                self._expires.pop(key, None)
+
+    def incr(self, key, timeout):
+        with self._lock:
+            if key not in self._counters:
+                now = time.time()
+                self._prune(now)
+                self._counters[key] = 0
+                self._expires[key] = now + timeout
+
+            self._counters[key] += 1
+            return self._counters[key]
+
+    def get(self, key):
+        with self._lock:
+            if self._expires.get(key, 0) > time.time():
+                return self._counters[key]
+
+
+class BatchedRateLimiter(RateLimiter):
+    """Approximate rate limiter that aggregates hits in-process and flushes
+    them to a shared Django cache in batches. Pending hits for a key are
+    flushed once `flush_count` hits have accumulated or `flush_interval`
+    seconds have passed since the key was last synchronized, whichever
+    comes first. The counts read back from the shared cache are reused
+    between flushes.
+
+    Each process can hold back at most `flush_count - 1` hits per client
+    from the other processes, so the limit may be exceeded by up to that
+    many hits per process. Set `flush_count` to 1 for exact counting.
+    """
+    def __init__(self, cache=None, flush_count=10, flush_interval=1):
+        self.limiter = CacheRateLimiter(cache)
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+
+        # Per key state: [shared count, pending hits, last sync, expiry]
+        self._counters = {}
+        self._pruned = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        if now - self._pruned < self.flush_interval:
+            return
+
+        self._pruned = now
+
+        for key, counter in list(self._counters.items()):
+            if counter[3] <= now:
+                del self._counters[key]
+
+    # Adds the pending hits to the shared count and returns it. Called
+    # without holding the lock, so other keys are not blocked by the cache
+    # round trip.
+    def _flush(self, key, pending, timeout):
+        cache = self.limiter.cache
+
+        if cache.add(key, pending, timeout):
+            return pending
+
+        try:
+            return cache.incr(key, pending)
+        except ValueError:
+            cache.set(key, pending, timeout)
+            return pending
+
+    def incr(self, key, timeout):
+        now = time.time()
+
+        with self._lock:
+            counter = self._counters.get(key)
+
+            if counter is None:
+                self._prune(now)
+                counter = self._counters[key] = [0, 0, 0, now + timeout]
+
+            counter[1] += 1
+
+            if counter[1] < self.flush_count and \
+                    now - counter[2] < self.flush_interval:
+                return counter[0] + counter[1]
+
+            # The pending hits are taken so hits arriving during the flush
+            # are kept for the next one
+            pending, counter[1] = counter[1], 0
+            counter[2] = now
+
+        try:
+            shared = self._flush(key, pending, timeout)
+        except Exception:
+            with self._lock:
+                counter[1] += pending
+            raise
+
+        with self._lock:
+            # Concurrent flushes of the same key may complete out of order
+            counter[0] = max(counter[0], shared)
+            return counter[0] + counter[1]
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            counter = self._counters.get(key)
+
+            if counter is not None and now - counter[2] < self.flush_interval:
+                return counter[0] + counter[1]
+
+        shared = self.limiter.get(key) or 0
+
+        with self._lock:
+            counter = self._counters.get(key)
+
+            # Only cache the value for reads, e.g. of the previous window
+            if counter is None:
+                expires = now + self.flush_interval
+                self._counters[key] = [shared, 0, now, expires]
+                return shared
+
+            counter[0] = max(counter[0], shared)
+
+            # Pending hits must still be flushed on the next increment
+            if not counter[1]:
+                counter[2] = now
+
+            return counter[0] + counter[1]
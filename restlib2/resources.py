@@ -1,23 +1,66 @@
 import io
+import os
+import copy
+import re
 import time
+import uuid
+import logging
+import threading
 import hashlib
 import collections
-from six import add_metaclass
+from functools import partial
+from stat import S_ISREG
+from six import add_metaclass, get_unbound_function
 # http://mail.python.org/pipermail/python-list/2010-March/1239510.html
 from calendar import timegm
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.db import connections
 from django.http import HttpResponse, HttpRequest
-from django.utils.http import http_date, parse_http_date, parse_etags, \
-    quote_etag
+try:
+    from django.http import StreamingHttpResponse
+    from django.http.response import HttpResponseBase
+# Django < 1.5 has no streaming responses
+except ImportError:
+    StreamingHttpResponse = None
+    HttpResponseBase = HttpResponse
+from django.utils.http import http_date, parse_http_date, \
+    parse_http_date_safe, parse_etags, quote_etag
 from django.utils.cache import patch_cache_control
 from .http import codes, methods
 from .serializers import serializers
-from .mixins import TemplateResponseMixin
+from .cache import etags, representations, coalescer, freeze_response, \
+    thaw_response
+from .mixins import TemplateResponseMixin, PreconditionFailed
+from . import dependencies, events
+from .ratelimit import CacheRateLimiter
+from .streams import LimitedInput, RequestEntityTooLarge
+from .patch import PatchError, PatchConflict, apply_patch, diff, \
+    JSON_PATCH
 from . import mimeparse
 
+logger = logging.getLogger(__name__)
+
 EPOCH_DATE = datetime(1970, 1, 1, 0, 0, 0)
-MAX_CACHE_AGE = 60 * 60 * 24 * 30
+
+# Size of the segments encoded chunks are buffered into before being
+# hashed. Encoders may produce very small chunks.
+ETAG_HASH_BUFFER_SIZE = 64 * 1024
+
+# ETags are validators rather than security tokens, so the fastest
+# available hash is used: xxHash if installed, otherwise BLAKE2 (Python
+# 3.6+), falling back to MD5.
+try:
+    import xxhash
+    default_etag_hasher = xxhash.xxh64
+except ImportError:
+    if hasattr(hashlib, 'blake2b'):
+        default_etag_hasher = partial(hashlib.blake2b, digest_size=16)
+    else:
+        default_etag_hasher = hashlib.md5
+
+# Size of the blocks files are streamed in
+FILE_BLOCK_SIZE = 64 * 1024
 
 # Convenience function for checking for existent, callable methods
 usable = lambda x, y: isinstance(getattr(x, y, None), collections.Callable)
@@ -31,6 +74,9 @@ except NameError:
 
 def no_content_response(response):
     "Cautious assessment of the response body for no content."
+    if getattr(response, 'streaming', False):
+        return False
+
     if not hasattr(response, '_container'):
         return True
 
@@ -44,6 +90,109 @@ def no_content_response(response):
     return False
 
 
+def file_stat(f):
+    "Returns the `os.fstat` result of a regular file object or `None`."
+    try:
+        stat = os.fstat(f.fileno())
+    except (AttributeError, IOError, OSError, ValueError):
+        return
+
+    if S_ISREG(stat.st_mode):
+        return stat
+
+
+def file_length(f, stat=None):
+    """Returns the number of bytes remaining from the current position of a
+    file object or `None` if it is not seekable.
+    """
+    try:
+        position = f.tell()
+
+        if stat is not None:
+            return stat.st_size - position
+
+        f.seek(0, io.SEEK_END)
+        length = f.tell() - position
+        f.seek(position)
+        return length
+    except (AttributeError, IOError, OSError, ValueError):
+        return
+
+
+def iter_file(f, block_size=FILE_BLOCK_SIZE):
+    "Reads a file object in blocks."
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        yield block
+
+
+# Matches a single, optionally weak, entity tag in a list of entity tags
+ETAG_MATCH = re.compile(r'(W/)?"((?:\\.|[^"])*)"')
+
+
+def parse_etag_list(value):
+    """Parses the value of an `If-Match` or `If-None-Match` header into a
+    list of `(etag, weak)` tuples. Returns `'*'` for the wildcard.
+    """
+    value = value.strip()
+
+    if value == '*':
+        return value
+
+    matches = ETAG_MATCH.findall(value)
+
+    # Be lenient with unquoted values
+    if not matches and value:
+        return [(value, False)]
+
+    return [(etag, bool(weak)) for weak, etag in matches]
+
+
+def parse_range_header(value, length):
+    """Parses a `Range` header into a list of inclusive `(start, end)` byte
+    positions for content of the given length. Ranges that cannot be
+    satisfied are dropped. Returns `None` if the header is not valid and
+    must be ignored.
+    """
+    unit, _, specs = value.partition('=')
+
+    if unit.strip().lower() != 'bytes':
+        return
+
+    ranges = []
+
+    for spec in specs.split(','):
+        start, sep, end = spec.strip().partition('-')
+
+        if not sep:
+            return
+
+        try:
+            # Suffix range, i.e. the last N bytes
+            if not start:
+                suffix = int(end)
+                if suffix > 0 and length:
+                    ranges.append((max(0, length - suffix), length - 1))
+                continue
+
+            start = int(start)
+            end = int(end) if end else length - 1
+        except ValueError:
+            return
+
+        if start >= length:
+            continue
+
+        if end < start:
+            return
+
+        ranges.append((start, min(end, length - 1)))
+
+    return ranges
+
+
 def get_content_length(request):
     try:
         return int(request.META.get('CONTENT_LENGTH'))
@@ -51,6 +200,14 @@ def get_content_length(request):
         return 0
 
 
+def get_meta_key(header):
+    "Returns the `request.META` key of a request header."
+    key = header.upper().replace('-', '_')
+    if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        key = 'HTTP_' + key
+    return key
+
+
 class UncacheableResponse(HttpResponse):
     "Response class that will never be cached."
     def __init__(self, *args, **kwargs):
@@ -104,6 +261,10 @@ class ResourceMetaclass(type):
         if not new_cls.supported_patch_types:
             new_cls.supported_patch_types = new_cls.supported_content_types
 
+        # Track changes to the models the resource depends on
+        for model in new_cls.cache_dependencies:
+            dependencies.register(model)
+
         return new_cls
 
     def __call__(cls, *args, **kwargs):
@@ -188,11 +349,26 @@ class Resource(object):
     rate_limit_count = None
     rate_limit_seconds = 60 * 60
 
+    # The `RateLimiter` used to count requests. Defaults to a sliding window
+    # counter stored in the cache returned by `get_cache`. Set this to a
+    # `LocalRateLimiter` instance for an in-process limiter.
+    rate_limiter = None
+
     # ### Max Request Entity Length
     # If not `None`, checks if the request entity body is too large to
-    # be processed.
+    # be processed. This is either a number of bytes or a dict of limits by
+    # content type with an optional `'*/*'` entry for other types. The
+    # `Content-Length` header is checked up front. Django already limits
+    # reads to that length, but the limit is also enforced while the body is
+    # read as a safeguard, e.g. for streams set up by other handlers.
     max_request_entity_length = None
 
+    # ### Request Decoder Options
+    # Options passed to decoders that read the request body as a stream, by
+    # content type. For example, the limits of multipart bodies are set with
+    # `{'multipart/form-data': {'max_part_size': 10 * 1024 * 1024}}`.
+    request_decoder_options = None
+
     # ### Supported _Accept_ Mimetypes
     # Define a list of mimetypes supported for encoding response entity
     # bodies. Default to `('application/json',)`
@@ -211,6 +387,43 @@ class Resource(object):
     # `supported_content_types`.
     supported_patch_types = None
 
+    # ### Range Requests
+    # If `True`, _GET_ responses advertise `Accept-Ranges: bytes` and
+    # requests with a `Range` header are responded to with the requested
+    # byte ranges (206 Partial Content). An `If-Range` header is validated
+    # against the ETag or Last-Modified validators. Seekable file objects
+    # returned by a handler are read only for the requested ranges if the
+    # ETag does not need to be calculated from the body.
+    use_ranges = False
+
+    # Maximum number of ranges served in a single response. Requests for
+    # more ranges are responded to with the full representation.
+    max_ranges = 20
+
+    # ### Long Polling
+    # Maximum number of seconds a conditional _GET_ request for an
+    # unchanged entity waits for a change if the client asks for it. See
+    # `wait_for_change`.
+    long_poll_timeout = None
+
+    # Number of seconds between checks of the validators while waiting.
+    long_poll_interval = 5
+
+    # ### Delta Encoding
+    # If `True`, recent JSON representations are kept by ETag so clients
+    # polling the resource can request the changes since the version they
+    # have. A _GET_ request with an `If-None-Match` header and `json-patch`
+    # in its `A-IM` header is responded to with a _226 IM Used_ response
+    # containing a JSON Patch from that version to the current one, if the
+    # version is still known and the patch is smaller than the full
+    # representation. See [RFC 3229][0].
+    #
+    # [0]: http://tools.ietf.org/html/rfc3229
+    delta_encoding = False
+
+    # Number of seconds representations are kept for computing deltas.
+    delta_timeout = 60 * 10
+
     # ### Validation Caching
 
     # #### Require Conditional Request
@@ -262,6 +475,70 @@ class Resource(object):
     # - http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.9.4
     cache_must_revalidate = False
 
+    # Applies to cache servers. The number of seconds a cache may serve a
+    # stale response while it revalidates it in the background. If the
+    # server response cache is used, stale entries are served and
+    # refreshed in a background thread the same way. The handler is then
+    # called with a copy of the request, see `copy_request`.
+    # - http://tools.ietf.org/html/rfc5861#section-3
+    stale_while_revalidate = None
+
+    # Applies to cache servers. The number of seconds a cache may serve a
+    # stale response if revalidating it fails with an error. If the server
+    # response cache is used, stale entries are served if the handler
+    # raises an exception or returns a 5xx response.
+    # - http://tools.ietf.org/html/rfc5861#section-4
+    stale_if_error = None
+
+    # ### Server Cache
+    # The cache used for ETag look ups and rate limiting. Defaults to
+    # Django's default cache. Set to a `TieredCache` instance to serve
+    # repeated look ups from an in-process tier.
+    cache_backend = None
+
+    # #### Cache Dependencies
+    # Models the representations of this resource depend on. Changes to
+    # these models, tracked via model signals, invalidate cached responses
+    # and ETags of this resource immediately, so long cache timeouts can be
+    # used safely. See also `get_cache_tags` for depending on specific
+    # instances.
+    cache_dependencies = ()
+
+    # #### Response Caching
+    # If `True`, complete `GET` responses are cached in the server cache
+    # for `cache_max_age` and served without calling the handler. Entries
+    # are keyed by the URL, the negotiated accept type and the request
+    # headers listed in `response_cache_vary`, e.g. `('Cookie',)` for
+    # user-specific representations.
+    cache_responses = False
+    response_cache_vary = ()
+
+    # Expired entries are kept this many seconds longer. While one worker
+    # recomputes an expired entry, other requests for it are served the
+    # stale copy rather than all calling the handler at once.
+    response_cache_grace = 60
+
+    # Maximum number of seconds a request waits for another worker to
+    # compute an entry when no stale copy is available. This also bounds
+    # how long the recompute lock is held if a worker dies.
+    response_cache_lock_timeout = 10
+
+    # #### Request Coalescing
+    # If `True`, concurrent identical _GET_ and _HEAD_ requests handled by
+    # this process share a single handler execution. Requests are
+    # identical if they have the same method, response cache key, which
+    # includes the headers listed in `response_cache_vary`, and version of
+    # the cache dependencies. The `SingleFlight` used defaults to
+    # `restlib2.cache.coalescer` whose `saved` counter reports the number
+    # of executions that were saved.
+    coalesce_requests = False
+    coalescer = None
+
+    # Request headers that must also be equal for requests to share a
+    # response. Defaults to the credentials so representations specific
+    # to a user are never handed to another one.
+    coalesce_vary = ('Authorization', 'Cookie')
+
     def __init__(self, **kwargs):
         for key in kwargs:
             # Not methods nor methods
@@ -281,26 +558,54 @@ class Resource(object):
         return self.dispatch(request, *args, **kwargs)
 
     def dispatch(self, request, *args, **kwargs):
-        # Process the request. This includes all the necessary checks prior to
-        # actually interfacing with the resource itself.
-        response = self.process_request(request, *args, **kwargs)
-
-        if not isinstance(response, HttpResponse):
-            # Attempt to process the request given the corresponding
-            # `request.method` handler.
-            method_handler = getattr(self, request.method.lower())
-            response = method_handler(request, *args, **kwargs)
+        try:
+            # Process the request. This includes all the necessary checks
+            # prior to actually interfacing with the resource itself.
+            response = self.process_request(request, *args, **kwargs)
 
             if not isinstance(response, HttpResponse):
-                # If the return value of the handler is not a response, pass
-                # the return value into the render method.
-                response = self.render(request, response, args=args,
-                                       kwargs=kwargs)
+                if self.cache_responses and \
+                        request.method in (methods.GET, methods.HEAD):
+                    response = self.cached_response(request, *args,
+                                                    **kwargs)
+                elif self.coalesce_requests and \
+                        request.method in (methods.GET, methods.HEAD):
+                    response = self.coalesced_response(request, *args,
+                                                       **kwargs)
+                else:
+                    response = self.handle(request, *args, **kwargs)
+        # The request body exceeded `max_request_entity_length` while it was
+        # being read.
+        except RequestEntityTooLarge:
+            response = HttpResponse(status=codes.request_entity_too_large)
+        # A `test` operation of a patch failed, see `patch_document`
+        except PatchConflict:
+            response = HttpResponse(status=codes.conflict)
+        # The patch document is not valid or could not be applied
+        except PatchError:
+            response = HttpResponse(status=codes.unprocessable_entity)
+        # A conditional write lost the race with another write
+        except PreconditionFailed:
+            response = UncacheableResponse(status=codes.precondition_failed)
 
         # Process the response, check if the response is overridden and
         # use that instead.
         return self.process_response(request, response)
 
+    def handle(self, request, *args, **kwargs):
+        # Attempt to process the request given the corresponding
+        # `request.method` handler.
+        method_handler = getattr(self, request.method.lower())
+        response = method_handler(request, *args, **kwargs)
+
+        if not isinstance(response, HttpResponseBase):
+            # If the return value of the handler is not a response, pass
+            # the return value into the render method.
+            response = self.render(request, response, args=args,
+                                   kwargs=kwargs)
+
+        return response
+
     def render(self, request, content=None, status=codes.ok, content_type=None,
                args=None, kwargs=None):
         "Renders the response based on the content returned from the handler."
@@ -308,21 +613,263 @@ class Resource(object):
         response = HttpResponse(status=status, content_type=content_type)
 
         if content is not None:
+            # File objects are streamed rather than read into memory
+            if hasattr(content, 'read') and \
+                    not isinstance(content, (str, bytes)):
+                return self.render_file(request, response, content,
+                                        args, kwargs)
+
             if not isinstance(content, (str, bytes, io.IOBase)):
                 accept_type = self.get_accept_type(request)
 
                 if serializers.supports_encoding(accept_type):
-                    content = serializers.encode(accept_type, content)
                     response['Content-Type'] = accept_type
 
+                    # The body of a _HEAD_ response is discarded, so the
+                    # content is only encoded if the ETag must be
+                    # calculated from it.
+                    if request.method == methods.HEAD and \
+                            not self.etag_requires_body(request):
+                        return response
+
+                    content = self.encode_content(request, response,
+                                                  accept_type, content)
+
             response.content = content
 
+            if request.method == methods.HEAD:
+                response['Content-Length'] = len(response.content)
+
         return response
 
+    # ### File Responses
+    # File objects returned by a handler are streamed to the client in
+    # blocks rather than read into memory. The ETag, Last-Modified date and
+    # length of regular files are derived from `os.fstat`, so the file is
+    # never hashed. The file is exposed as `file_to_stream` which Django 1.8+
+    # hands to the server's `wsgi.file_wrapper`, e.g. to use `sendfile`.
+    # Files without a descriptor are read into memory if the ETag must be
+    # calculated from the body.
+    #
+    # The modification time of the file is used as the Last-Modified date
+    # unless `get_last_modified` is overridden. Since it is only known once
+    # the handler returned the file, `If-Modified-Since` is evaluated here.
+    def render_file(self, request, response, content, args=None,
+                    kwargs=None):
+        stat = file_stat(content)
+
+        if stat is not None:
+            if self.use_etags and getattr(request, '_etag', None) is None:
+                request._etag = self.get_file_etag(request, stat)
+
+            if self.use_last_modified and \
+                    get_unbound_function(self.__class__.get_last_modified) \
+                    is get_unbound_function(Resource.get_last_modified):
+                request._last_modified = datetime.utcfromtimestamp(
+                    int(stat.st_mtime))
+
+                if self.is_file_not_modified(request):
+                    content.close()
+                    response.status_code = codes.not_modified
+                    return response
+
+        length = file_length(content, stat)
+
+        # Only read the requested ranges from the file
+        if self.use_ranges and length is not None and \
+                request.method == methods.GET and \
+                'HTTP_RANGE' in request.META and \
+                not self.etag_requires_body(request):
+            offset = content.tell()
+
+            def read(start, end):
+                content.seek(offset + start)
+                return content.read(end - start + 1)
+
+            etag = getattr(request, '_etag', None)
+            last_modified = None
+
+            if self.use_last_modified:
+                last_modified = self._get_last_modified(
+                    request, *(args or ()), **(kwargs or {}))
+                if last_modified is not None:
+                    last_modified = http_date(
+                        timegm(last_modified.utctimetuple()))
+
+            if self.range_applies(request, etag, last_modified):
+                if self.apply_ranges(request, response, read, length):
+                    return response
+
+            content.seek(offset)
+
+        if StreamingHttpResponse is None or \
+                (request.method in (methods.GET, methods.HEAD) and
+                 self.etag_requires_body(request)):
+            response.content = content.read()
+
+            if request.method == methods.HEAD:
+                response['Content-Length'] = len(response.content)
+
+            return response
+
+        streaming = StreamingHttpResponse(
+            iter_file(content), status=response.status_code,
+            content_type=response['Content-Type'])
+
+        streaming.file_to_stream = content
+        # Closed along with the response
+        streaming._closable_objects.append(content)
+
+        if length is not None:
+            streaming['Content-Length'] = length
+
+            if self.use_ranges:
+                streaming['Accept-Ranges'] = 'bytes'
+
+        return streaming
+
+    # Checks `If-Modified-Since` against the modification time of a file.
+    # As for other responses, it is ignored if `If-None-Match` is present.
+    def is_file_not_modified(self, request):
+        if request.method not in (methods.GET, methods.HEAD) or \
+                'HTTP_IF_NONE_MATCH' in request.META:
+            return False
+
+        known_last_modified = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+
+        if known_last_modified is None:
+            return False
+
+        known_last_modified = EPOCH_DATE + timedelta(
+            seconds=known_last_modified)
+        return known_last_modified >= request._last_modified
+
+    # Returns the ETag of a regular file from its `os.stat` result. The
+    # inode, size and modification time change whenever the file is
+    # replaced or written to.
+    def get_file_etag(self, request, stat):
+        return '{0:x}-{1:x}-{2:x}'.format(stat.st_ino, stat.st_size,
+                                          int(stat.st_mtime * 1000000))
+
+    # ## Range Requests
+
+    # Checks the `If-Range` header, if present, against the current ETag or
+    # Last-Modified date. Only strong ETags and exact dates match.
+    def range_applies(self, request, etag, last_modified):
+        value = request.META.get('HTTP_IF_RANGE', '').strip()
+
+        if not value:
+            return True
+
+        if value.startswith('W/') or value.startswith('"'):
+            candidates = parse_etag_list(value)
+            return etag is not None and (etag, False) in candidates
+
+        if last_modified is None:
+            return False
+
+        return parse_http_date_safe(value) == \
+            parse_http_date_safe(last_modified)
+
+    # Sets the requested ranges as the content of the response. `read` takes
+    # the inclusive start and end positions and returns the bytes in that
+    # range. Returns `False` if the `Range` header is ignored and the full
+    # content must be returned.
+    def apply_ranges(self, request, response, read, length):
+        ranges = parse_range_header(request.META['HTTP_RANGE'], length)
+
+        if ranges is None or len(ranges) > self.max_ranges:
+            return False
+
+        if not ranges:
+            response.status_code = codes.requested_range_not_satisfiable
+            response['Content-Range'] = 'bytes */{0}'.format(length)
+            response.content = b''
+            return True
+
+        response.status_code = codes.partial_content
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, end, length)
+            response.content = read(start, end)
+            return True
+
+        boundary = uuid.uuid4().hex
+        content_type = response.get('Content-Type')
+        parts = []
+
+        for start, end in ranges:
+            headers = ['', '--' + boundary]
+            if content_type:
+                headers.append('Content-Type: ' + content_type)
+            headers.append('Content-Range: bytes {0}-{1}/{2}'.format(
+                start, end, length))
+            headers.extend(['', ''])
+
+            parts.append('\r\n'.join(headers).encode('ascii'))
+            parts.append(read(start, end))
+
+        parts.append('\r\n--{0}--\r\n'.format(boundary).encode('ascii'))
+
+        response.content = b''.join(parts)
+        response['Content-Type'] = \
+            'multipart/byteranges; boundary=' + boundary
+        return True
+
+    # Returns true if the ETag of the response to this request can only be
+    # calculated by hashing the body, i.e. no cheap validator is defined.
+    def etag_requires_body(self, request):
+        return self.use_etags and getattr(request, '_etag', None) is None
+
+    # Encodes the content for the accept type. If an ETag will be set on the
+    # response, the body is hashed while it is being encoded rather than
+    # scanning the full body again afterwards.
+    def encode_content(self, request, response, accept_type, content):
+        if not self.use_etags or request.method not in (methods.GET,
+                                                        methods.HEAD):
+            return serializers.encode(accept_type, content)
+
+        # A cheap validator has been calculated, the body need not be hashed
+        if getattr(request, '_etag', None) is not None:
+            return serializers.encode(accept_type, content)
+
+        hasher = self.get_etag_hasher(request, response)
+        chunks = serializers.iterencode(accept_type, content)
+        segments, segment, size = [], [], 0
+
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode('utf-8')
+
+            segment.append(chunk)
+            size += len(chunk)
+
+            if size >= ETAG_HASH_BUFFER_SIZE:
+                segment = b''.join(segment)
+                hasher.update(segment)
+                segments.append(segment)
+                segment, size = [], 0
+
+        if segment:
+            segment = b''.join(segment)
+            hasher.update(segment)
+            segments.append(segment)
+
+        response['ETag'] = quote_etag(hasher.hexdigest())
+        return b''.join(segments)
+
     # ## Request Method Handlers
     # ### _HEAD_ Request Handler
     # Default handler for _HEAD_ requests. For this to be available,
-    # a _GET_ handler must be defined.
+    # a _GET_ handler must be defined. The content returned by the _GET_
+    # handler is not encoded unless it is required for calculating the
+    # ETag. Resources that can determine the headers without loading the
+    # data, e.g. using `calculate_etag` and `get_last_modified`, can
+    # override this handler and return `None` or a response with the
+    # headers set.
     def head(self, request, *args, **kwargs):
         return self.get(request, *args, **kwargs)
 
@@ -339,6 +886,21 @@ class Resource(object):
         response['Content-Length'] = 0
         return response
 
+    # ### Patch Documents
+    # Applies the patch document of a _PATCH_ request to the current
+    # representation of the entity, e.g. a dict. JSON Patch and JSON Merge
+    # Patch documents are supported, add their mimetypes to
+    # `supported_patch_types` to accept them. The document is changed in
+    # place where possible and returned along with the set of top-level
+    # members that changed, which can be passed to `patch.changes` for a
+    # partial `update()` of only those fields. An invalid patch results in
+    # a _422 Unprocessable Entity_ response and a failed `test` operation
+    # in a _409 Conflict_ response, the document is left unchanged in both
+    # cases.
+    def patch_document(self, request, document):
+        return apply_patch(request._content_type, document,
+                           getattr(request, 'data', None))
+
     # ## Response Status Code Handlers
     # Each handler prefixed with `is_` corresponds to various client (4xx)
     # and server (5xx) error checking. For example, `is_not_found` will
@@ -376,18 +938,71 @@ class Resource(object):
         return False
 
     # ### Too Many Requests
-    # Checks if this request is rate limited. Default is a no-op.
+    # Checks if this request is rate limited. Requests are counted per
+    # client, as identified by `get_rate_limit_key`, using `rate_limiter`.
+    # The `X-RateLimit-*` headers are set on every response and the
+    # `Retry-After` header is set if the limit has been exceeded.
     def is_too_many_requests(self, request, response, *args, **kwargs):
+        key = self.get_rate_limit_key(request, *args, **kwargs)
+
+        if key is None:
+            return False
+
+        limiter = self.get_rate_limiter(request, response)
+        rate_limit = limiter.hit(key, self.rate_limit_count,
+                                 self.rate_limit_seconds)
+
+        # Kept for setting the headers on the final response
+        request._rate_limit = rate_limit
+        self.set_rate_limit_headers(request, response)
+
+        if not rate_limit.allowed:
+            response['Retry-After'] = rate_limit.retry_after
+            return True
         return False
 
     # ### Request Entity Too Large
     # Check if the request entity is too large to process.
     def is_request_entity_too_large(self, request, response, *args, **kwargs):
-        content_length = get_content_length(request)
-        if self.max_request_entity_length and \
-                content_length > self.max_request_entity_length:
+        max_length = self.get_max_request_entity_length(request, *args,
+                                                        **kwargs)
+        if not max_length:
+            return False
+
+        if get_content_length(request) > max_length:
             return True
 
+        # The body may have been read already, e.g. by a middleware
+        if hasattr(request, '_body'):
+            return len(request._body) > max_length
+
+        # Otherwise the stream is also wrapped, as defense-in-depth, so
+        # reading past the limit raises `RequestEntityTooLarge` which results
+        # in the same response. `WSGIRequest` already limits its stream to
+        # the `Content-Length`, so this only matters for request classes
+        # and stream wrappers that do not.
+        if hasattr(request, '_stream'):
+            request._stream = LimitedInput(request._stream, max_length)
+
+        return False
+
+    # Returns the options passed to the stream decoder of the content type.
+    def get_request_decoder_options(self, request, content_type):
+        return dict((self.request_decoder_options or {})
+                    .get(content_type, {}))
+
+    # Returns the maximum length of the request body for its content type.
+    def get_max_request_entity_length(self, request, *args, **kwargs):
+        max_length = self.max_request_entity_length
+
+        if isinstance(max_length, dict):
+            content_type = request.META.get('CONTENT_TYPE', '')
+            content_type = content_type.split(';')[0].strip().lower()
+            max_length = max_length.get(content_type,
+                                        max_length.get('*/*'))
+
+        return max_length
+
     # ### Method Not Allowed
     # Check if the request method is not allowed.
     def is_method_not_allowed(self, request, response, *args, **kwargs):
@@ -457,9 +1072,9 @@ class Resource(object):
         # ETag value is used for the conditional requests. After the request
         # method handler has been processed, the new ETag will be calculated.
         if self.use_etags and 'HTTP_IF_MATCH' in request.META:
-            request_etag = parse_etags(request.META['HTTP_IF_MATCH'])[0]
-            etag = self.get_etag(request, request_etag)
-            if request_etag != etag:
+            etag = self.match_etags(request, response, 'HTTP_IF_MATCH',
+                                    False, *args, **kwargs)
+            if etag is None:
                 return True
 
         # Last-Modified date enabled. check for conditional request headers.
@@ -468,7 +1083,7 @@ class Resource(object):
         # new Last-Modified datetime will be returned.
         if self.use_last_modified and 'HTTP_IF_UNMODIFIED_SINCE' in \
                 request.META:
-            last_modified = self.get_last_modified(request, *args, **kwargs)
+            last_modified = self._get_last_modified(request, *args, **kwargs)
             known_last_modified = EPOCH_DATE + timedelta(
                 seconds=parse_http_date(
                     request.META['HTTP_IF_UNMODIFIED_SINCE']))
@@ -477,6 +1092,118 @@ class Resource(object):
 
         return False
 
+    # ### Not Modified
+    # Checks if the representation the client has of the entity, based on
+    # the conditional headers of a _GET_ or _HEAD_ request, is current.
+    def is_not_modified(self, request, response, *args, **kwargs):
+        # Cheap validators are calculated before the handler is called
+        # and reused when the response headers are set, which is done
+        # without the URL arguments.
+        if self.use_etags:
+            self._calculate_etag(request, *args, **kwargs)
+
+        if self.use_last_modified:
+            self._get_last_modified(request, *args, **kwargs)
+
+        # Check Etags before Last-Modified...
+        if self.use_etags and 'HTTP_IF_NONE_MATCH' in request.META:
+            # Check if any of the request Etags is valid, using weak
+            # comparison as defined for `If-None-Match`.
+            etag = self.match_etags(request, response, 'HTTP_IF_NONE_MATCH',
+                                    True, *args, **kwargs)
+
+            # Nothing has changed
+            if etag is not None:
+                if etag != '*':
+                    response['ETag'] = quote_etag(etag)
+                return True
+
+        # `If-Modified-Since` is ignored if `If-None-Match` is present.
+        # See [RFC 7232][0].
+        # [0]: http://tools.ietf.org/html/rfc7232#section-3.3
+        elif self.use_last_modified and 'HTTP_IF_MODIFIED_SINCE' in \
+                request.META:
+            # Get the last known modified date from the client, compare it
+            # to the last modified date of the resource
+            last_modified = self._get_last_modified(request, *args, **kwargs)
+            known_last_modified = EPOCH_DATE + timedelta(
+                seconds=parse_http_date(
+                    request.META['HTTP_IF_MODIFIED_SINCE']))
+
+            if last_modified is not None and \
+                    known_last_modified >= last_modified:
+                return True
+
+        return False
+
+    # ### Wait For Change
+    # Blocks a conditional request for an unchanged entity until one of its
+    # event tags is published or the wait time passes. Clients opt in with
+    # a `Prefer: wait=<seconds>` header ([RFC 7240][0]) which is capped by
+    # `long_poll_timeout`. Returns `True` if the entity changed and the
+    # request continues as usual, otherwise a _304 Not Modified_ response
+    # is returned.
+    #
+    # Changes are published in-process, see `restlib2.events`. The
+    # validators are also checked every `long_poll_interval` seconds, so
+    # changes made by other processes are picked up. Each waiting request
+    # holds a worker thread.
+    #
+    # [0]: http://tools.ietf.org/html/rfc7240#section-4.3
+    def wait_for_change(self, request, response, *args, **kwargs):
+        timeout = self.get_long_poll_timeout(request)
+
+        if not timeout:
+            return False
+
+        tags = self.get_event_tags(request, *args, **kwargs)
+
+        if not tags:
+            return False
+
+        deadline = time.time() + timeout
+
+        with events.broker.subscribe(tags) as subscription:
+            while True:
+                # A change may have been published before subscribing
+                self.reset_validators(request, *args, **kwargs)
+
+                if not self.is_not_modified(request, response, *args,
+                                            **kwargs):
+                    return True
+
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return False
+
+                subscription.wait(min(remaining, self.long_poll_interval))
+
+    # Returns the number of seconds the client prefers to wait for a change.
+    def get_long_poll_timeout(self, request):
+        if not self.long_poll_timeout:
+            return
+
+        for preference in request.META.get('HTTP_PREFER', '').split(','):
+            name, _, value = preference.split(';')[0].partition('=')
+
+            if name.strip().lower() == 'wait':
+                try:
+                    wait = float(value.strip().strip('"'))
+                except ValueError:
+                    return
+
+                return max(0, min(wait, self.long_poll_timeout))
+
+    # Clears the memoized validators so they are calculated again.
+    def reset_validators(self, request, *args, **kwargs):
+        for attr in ('_etag', '_last_modified', '_cache_version',
+                     '_cache_modified'):
+            if hasattr(request, attr):
+                delattr(request, attr)
+
+        self._get_cache_version(request, *args, **kwargs)
+
     # ### Not Found
     # Checks if the requested resource exists.
     def is_not_found(self, request, response, *args, **kwargs):
@@ -545,36 +1272,181 @@ class Resource(object):
     # For PUT, PATCH, and DELETE requests, the `If-Match` header may be
     # set to ensure the entity is the same as the cllient's so the current
     # operation is valid (optimistic concurrency).
-    def get_etag(self, request, response, etag=None):
+    def get_etag(self, request, response, etag=None, *args, **kwargs):
+        # Use the cheap validator if the resource defines one
+        current = self._calculate_etag(request, *args, **kwargs)
+        if current is not None:
+            return current
+
+        # Check the ETags registered for this resource
+        if etag is not None:
+            cache = self.get_cache(request, response)
+            if etags.is_registered(cache, self.get_etag_key(request, etag)):
+                return etag
+
+    # ### Match Request ETags
+    # Returns the ETag of the request header that matches the current state
+    # of the entity, or `None` if none match. The header may contain a list
+    # of ETags or `*` which matches any current representation. Weak ETags
+    # only match if `weak` comparison is used, i.e. for `If-None-Match`.
+    # If the current ETag is known from `calculate_etag`, the request ETags
+    # are compared against it. Otherwise all candidates are looked up in the
+    # ETag registry at once. An overridden `get_etag` is called with each
+    # candidate and returns it if it is still valid.
+    def match_etags(self, request, response, header, weak, *args, **kwargs):
+        candidates = parse_etag_list(request.META[header])
+        overridden = get_unbound_function(self.__class__.get_etag) is not \
+            get_unbound_function(Resource.get_etag)
+
+        if overridden:
+            if candidates == '*':
+                return self.get_etag(request, response, None, *args,
+                                     **kwargs) or candidates
+
+            for etag, is_weak in candidates:
+                if (weak or not is_weak) and etag == self.get_etag(
+                        request, response, etag, *args, **kwargs):
+                    return etag
+            return
+
+        current = self.get_etag(request, response, None, *args, **kwargs)
+
+        if candidates == '*':
+            return current or candidates
+
+        candidates = [etag for etag, is_weak in candidates
+                      if weak or not is_weak]
+
+        if current is not None:
+            if current in candidates:
+                return current
+            return
+
+        if not candidates:
+            return
+
+        keys = dict((self.get_etag_key(request, etag), etag)
+                    for etag in candidates)
         cache = self.get_cache(request, response)
-        # Check cache first
-        if etag is not None and etag in cache:
-            return etag
+        registered = etags.registered(cache, list(keys))
+
+        for key in keys:
+            if key in registered:
+                return keys[key]
+
+    # ### Cheap Validators
+    # Calculates the ETag for the current state of the requested entity
+    # without rendering it, e.g. from a version column or the entity's
+    # `updated_at` timestamp. If defined, conditional requests are
+    # evaluated before the handler is called and the value is used as
+    # the `ETag` of the response rather than hashing the body. Default is
+    # `None`, meaning the body is hashed.
+    def calculate_etag(self, request, *args, **kwargs):
+        return None
+
+    # The calculated ETag is memoized on the request so it is evaluated at
+    # most once per request.
+    def _calculate_etag(self, request, *args, **kwargs):
+        if not hasattr(request, '_etag'):
+            request._etag = self.calculate_etag(request, *args, **kwargs)
+        return request._etag
+
+    # Returns a new hash object used for calculating ETags from the response
+    # body. Must support the `update` and `hexdigest` methods of `hashlib`
+    # hash objects.
+    def get_etag_hasher(self, request, response):
+        return default_etag_hasher()
 
     # If the Etag has been set already upstream use it, otherwise calculate
+    # it from the body. Streaming responses are not hashed since the body
+    # is only produced after the headers have been sent.
     def set_etag(self, request, response):
         if 'ETag' in response:
             etag = parse_etags(response['ETag'])[0]
+        elif getattr(request, '_etag', None) is not None:
+            etag = request._etag
+            response['ETag'] = quote_etag(etag)
+        # The body of a _HEAD_ response is always empty, so its ETag can only
+        # be set while encoding or from `calculate_etag`. Empty bodies do not
+        # identify a representation.
+        elif getattr(response, 'streaming', False) or \
+                request.method == methods.HEAD or not response.content:
+            return
         else:
-            etag = hashlib.md5(response.content).hexdigest()
+            hasher = self.get_etag_hasher(request, response)
+            hasher.update(response.content)
+            etag = hasher.hexdigest()
             response['ETag'] = quote_etag(etag)
 
-        # Cache the etag for subsequent look ups. This can be cached
-        # indefinitely since these are unique values
+        # Register the etag for subsequent look ups. Repeated registrations
+        # of the same etag do not result in additional cache writes.
         cache = self.get_cache(request, response)
-        cache.set(etag, 1, MAX_CACHE_AGE)
+        etags.register(cache, self.get_etag_key(request, etag))
+
+    # Returns the cache key an ETag is registered under. Keys are namespaced
+    # by the resource and the requested URL so an ETag handed out for one
+    # resource does not validate requests to another. The version of the
+    # cache dependencies is included so changes invalidate them.
+    def get_etag_key(self, request, etag):
+        path = hashlib.md5(request.get_full_path().encode('utf-8'))
+        return 'restlib2:etag:{0}.{1}:{2}:{3}{4}'.format(
+            self.__module__, self.__class__.__name__, path.hexdigest(),
+            getattr(request, '_cache_version', ''), etag)
+
+    # ### Cache Dependency Tags
+    # Returns the tags cached representations of the requested entity
+    # depend on. Defaults to the tags of the `cache_dependencies` models.
+    # Use `dependencies.instance_tag` to add tags for specific instances,
+    # their generations are bumped when the instance changes.
+    def get_cache_tags(self, request, *args, **kwargs):
+        return [dependencies.model_tag(model)
+                for model in self.cache_dependencies]
+
+    # Returns the tags requests wait on for changes when long polling or
+    # streaming events. Defaults to the cache tags.
+    def get_event_tags(self, request, *args, **kwargs):
+        return self.get_cache_tags(request, *args, **kwargs)
+
+    # Returns a digest of the current generations of the cache tags. This
+    # is memoized on the request and included in cache keys. The time the
+    # tags were last modified is looked up at the same time.
+    def _get_cache_version(self, request, *args, **kwargs):
+        if not hasattr(request, '_cache_version'):
+            tags = self.get_cache_tags(request, *args, **kwargs)
+            request._cache_version, request._cache_modified = \
+                dependencies.tracker.state(tags)
+        return request._cache_version
 
     # ### Get/Calculate Last Modified Datetime
     # Calculates the last modified time for the requested entity.
     # Provides the client the last modified of the entity for future
-    # conditional requests.
-    def get_last_modified(self, request):
+    # conditional requests. Like `calculate_etag`, this is evaluated before
+    # the handler and should be cheap. If `cache_dependencies` are defined,
+    # the time any of the cache tags was last modified is used which
+    # requires no additional look ups.
+    def get_last_modified(self, request, *args, **kwargs):
+        if self.cache_dependencies:
+            self._get_cache_version(request, *args, **kwargs)
+            return request._cache_modified
         return datetime.now()
 
+    # The last modified time is memoized on the request and truncated to
+    # seconds since that is the precision of HTTP dates.
+    def _get_last_modified(self, request, *args, **kwargs):
+        if not hasattr(request, '_last_modified'):
+            last_modified = self.get_last_modified(request, *args, **kwargs)
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            request._last_modified = last_modified
+        return request._last_modified
+
     # Set the last modified date on the response
     def set_last_modified(self, request, response):
         if 'Last-Modified' not in response:
-            response['Last-Modified'] = self.get_last_modified(request)
+            last_modified = self._get_last_modified(request)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(
+                    timegm(last_modified.utctimetuple()))
 
     # ### Calculate Expiry Datetime
     # (not implemented)
@@ -598,7 +1470,11 @@ class Resource(object):
     # for decoding.
     def content_type_supported(self, request, response, *args, **kwargs):
         content_type = request.META['CONTENT_TYPE']
-        mimetypes = list(self.supported_content_types)
+
+        if request.method == methods.PATCH:
+            mimetypes = list(self.supported_patch_types)
+        else:
+            mimetypes = list(self.supported_content_types)
         mimetypes.reverse()
         match = mimeparse.best_match(mimetypes, content_type)
         if match:
@@ -612,9 +1488,44 @@ class Resource(object):
     def content_language_supported(self, request, response, *args, **kwargs):
         return True
 
+    # ## Rate Limiting Handlers
+
+    # Returns the key requests are counted against. Authenticated users are
+    # identified by their primary key, other clients by their IP address.
+    # Return `None` to exempt the request from rate limiting.
+    def get_rate_limit_key(self, request, *args, **kwargs):
+        user = getattr(request, 'user', None)
+
+        if user is not None and user.is_authenticated():
+            client = 'user:{0}'.format(user.pk)
+        else:
+            client = request.META.get('REMOTE_ADDR')
+
+        if client is None:
+            return
+
+        return '{0}.{1}:{2}'.format(self.__module__,
+                                    self.__class__.__name__, client)
+
+    def get_rate_limiter(self, request, response):
+        if self.rate_limiter is not None:
+            return self.rate_limiter
+        return CacheRateLimiter(self.get_cache(request, response))
+
+    def set_rate_limit_headers(self, request, response):
+        rate_limit = getattr(request, '_rate_limit', None)
+
+        if rate_limit is not None:
+            response['X-RateLimit-Limit'] = rate_limit.limit
+            response['X-RateLimit-Remaining'] = rate_limit.remaining
+            response['X-RateLimit-Reset'] = int(rate_limit.reset)
+
     # Utility methods
     def get_cache(self, request, response):
         "Returns the cache to be used for various components."
+        if self.cache_backend is not None:
+            return self.cache_backend
+
         from django.core.cache import cache
         return cache
 
@@ -623,6 +1534,190 @@ class Resource(object):
             return datetime.now() + self.cache_max_age
         return self.cache_max_age
 
+    # ## Response Caching
+    # Returns the cache key for the response to this request. The
+    # negotiated accept type is part of the key, so this must be called
+    # after `process_request`.
+    def get_response_cache_key(self, request):
+        parts = [request.get_full_path(), self.get_accept_type(request) or '']
+
+        for header in self.response_cache_vary:
+            parts.append(request.META.get(get_meta_key(header), ''))
+
+        parts.append(getattr(request, '_cache_version', ''))
+
+        digest = hashlib.md5('\n'.join(parts).encode('utf-8'))
+        return 'restlib2:response:{0}.{1}:{2}'.format(
+            self.__module__, self.__class__.__name__, digest.hexdigest())
+
+    # ### Request Coalescing
+    def get_coalescer(self, request):
+        if self.coalescer is not None:
+            return self.coalescer
+        return coalescer
+
+    # Calls the handler unless an identical request is already being
+    # handled, in which case its response is shared. Each request gets its
+    # own copy of the response since it is modified while being processed.
+    # Streaming responses cannot be shared, so the handler is called again
+    # for requests that were waiting on one.
+    def coalesced_response(self, request, *args, **kwargs):
+        credentials = hashlib.md5('\n'.join(
+            request.META.get(get_meta_key(header), '')
+            for header in self.coalesce_vary).encode('utf-8'))
+
+        key = '{0}:{1}:{2}'.format(self.get_response_cache_key(request),
+                                   request.method, credentials.hexdigest())
+
+        def execute():
+            response = self.handle(request, *args, **kwargs)
+
+            if getattr(response, 'streaming', False):
+                return response, None
+
+            return response, freeze_response(response, None)
+
+        coalescer = self.get_coalescer(request)
+        (response, entry), shared = coalescer.do(key, execute)
+
+        if not shared:
+            return response
+
+        if entry is None:
+            return self.handle(request, *args, **kwargs)
+
+        return thaw_response(entry)
+
+    # Returns the number of seconds responses are cached for, derived from
+    # `cache_max_age`.
+    def get_response_cache_timeout(self, request):
+        if isinstance(self.cache_max_age, timedelta):
+            return self.cache_max_age.days * 86400 + \
+                self.cache_max_age.seconds
+        return self.cache_max_age
+
+    # Returns the cached response for the request, calling the handler if
+    # no fresh entry exists. Only one worker recomputes an entry at a time,
+    # guarded by a lock created with the atomic `cache.add`. Other requests
+    # are served the stale entry if there is one, otherwise they wait for
+    # the entry to be computed.
+    def cached_response(self, request, *args, **kwargs):
+        timeout = self.get_response_cache_timeout(request)
+
+        if not timeout or timeout <= 0 or self.cache_no_store:
+            return self.handle(request, *args, **kwargs)
+
+        cache = self.get_cache(request, None)
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        now = time.time()
+
+        if entry is not None and entry['expires'] > now:
+            return thaw_response(entry)
+
+        # Entries are only created from GET responses since the HEAD
+        # handler is not required to produce a body.
+        if request.method == methods.HEAD:
+            if entry is not None:
+                return thaw_response(entry)
+            return self.handle(request, *args, **kwargs)
+
+        lock_key = key + ':lock'
+
+        # Serve the stale entry right away and refresh it in the background
+        if entry is not None and self.stale_while_revalidate and \
+                now < entry['expires'] + self.stale_while_revalidate:
+            if cache.add(lock_key, 1, self.response_cache_lock_timeout):
+                thread = threading.Thread(
+                    target=self.refresh_response,
+                    args=(self.copy_request(request), cache, key,
+                          timeout) + args,
+                    kwargs=kwargs)
+                thread.daemon = True
+                thread.start()
+            return thaw_response(entry)
+
+        if cache.add(lock_key, 1, self.response_cache_lock_timeout):
+            try:
+                response = self.handle(request, *args, **kwargs)
+            except Exception:
+                if self.can_serve_stale_on_error(entry, now):
+                    logger.exception('Serving stale response')
+                    return thaw_response(entry)
+                raise
+            finally:
+                cache.delete(lock_key)
+
+            if response.status_code >= 500 and \
+                    self.can_serve_stale_on_error(entry, now):
+                return thaw_response(entry)
+
+            self.cache_response(request, response, cache, key, timeout)
+            return response
+
+        if entry is not None:
+            return thaw_response(entry)
+
+        deadline = time.time() + self.response_cache_lock_timeout
+
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+
+            if entry is not None:
+                return thaw_response(entry)
+
+            # The worker holding the lock failed to compute the entry
+            if lock_key not in cache:
+                break
+
+        return self.handle(request, *args, **kwargs)
+
+    def can_serve_stale_on_error(self, entry, now):
+        return entry is not None and bool(self.stale_if_error) and \
+            now < entry['expires'] + self.stale_if_error
+
+    # Returns a copy of the request for calling the handler in a background
+    # thread while the request itself is still being processed. Attributes
+    # set on the copy, such as memoized validators or lookups attached by
+    # the handler, do not affect the original. The copy is shallow apart
+    # from `META`, so handlers run this way must not mutate other shared
+    # state of the request, e.g. the session.
+    def copy_request(self, request):
+        clone = copy.copy(request)
+        clone.META = request.META.copy()
+        return clone
+
+    # Computes and stores a fresh entry in a background thread. The caller
+    # must hold the recompute lock which is released once done.
+    def refresh_response(self, request, cache, key, timeout, *args,
+                         **kwargs):
+        try:
+            response = self.handle(request, *args, **kwargs)
+            self.cache_response(request, response, cache, key, timeout)
+        except Exception:
+            logger.exception('Error refreshing cached response')
+        finally:
+            cache.delete(key + ':lock')
+
+            for connection in connections.all():
+                connection.close()
+
+    # Stores the response if it is cacheable, i.e. a complete 200 response.
+    # Expired entries are kept long enough to be served stale.
+    def cache_response(self, request, response, cache, key, timeout):
+        if response.status_code != codes.ok or \
+                not isinstance(response, HttpResponse) or \
+                getattr(response, 'streaming', False):
+            return
+
+        stale = max(self.response_cache_grace,
+                    self.stale_while_revalidate or 0,
+                    self.stale_if_error or 0)
+
+        entry = freeze_response(response, time.time() + timeout)
+        cache.set(key, entry, timeout + stale)
+
     def response_cache_control(self, request, response):
         attrs = {}
         timeout = self.get_cache_timeout(request, response)
@@ -645,6 +1740,12 @@ class Resource(object):
         if self.cache_type:
             attrs[self.cache_type] = True
 
+        if self.stale_while_revalidate:
+            attrs['stale_while_revalidate'] = self.stale_while_revalidate
+
+        if self.stale_if_error:
+            attrs['stale_if_error'] = self.stale_if_error
+
         if attrs:
             patch_cache_control(response, **attrs)
 
@@ -759,6 +1860,10 @@ class Resource(object):
                                              **kwargs):
                 return UncacheableResponse(status=codes.precondition_required)
 
+        # The version of the cache dependencies is part of the cache keys of
+        # ETags and responses
+        self._get_cache_version(request, *args, **kwargs)
+
         # ### 412 Precondition Failed
         # Conditional requests applies to GET, HEAD, PUT, and PATCH.
         # For GET and HEAD, the request checks the either the entity changed
@@ -770,43 +1875,24 @@ class Resource(object):
 
         # Check for conditional GET or HEAD request
         if request.method == methods.GET or request.method == methods.HEAD:
-
-            # Check Etags before Last-Modified...
-            if self.use_etags and 'HTTP_IF_NONE_MATCH' in request.META:
-                # Parse request Etags (only one is currently supported)
-                request_etag = parse_etags(
-                    request.META['HTTP_IF_NONE_MATCH'])[0]
-
-                # Check if the request Etag is valid. The current Etag is
-                # supplied to enable strategies where the etag does not need
-                # to be used to regenerate the Etag. This may include
-                # generating an MD5 of the resource and storing it as a key
-                # in memcache.
-                etag = self.get_etag(request, response, request_etag, *args,
-                                     **kwargs)
-
-                # Nothing has changed, simply return
-                if request_etag == etag:
-                    response.status_code = codes.not_modified
-                    return response
-
-            if self.use_last_modified and 'HTTP_IF_MODIFIED_SINCE' in \
-                    request.META:
-                # Get the last known modified date from the client, compare it
-                # to the last modified date of the resource
-                last_modified = self.get_last_modified(request, *args,
-                                                       **kwargs)
-                known_last_modified = EPOCH_DATE + timedelta(
-                    seconds=parse_http_date(
-                        request.META['HTTP_IF_MODIFIED_SINCE']))
-
-                if known_last_modified >= last_modified:
+            if self.is_not_modified(request, response, *args, **kwargs):
+                # ### Long Polling
+                # Rather than responding that nothing has changed, the
+                # request may wait for a change.
+                if not self.wait_for_change(request, response, *args,
+                                            **kwargs):
                     response.status_code = codes.not_modified
                     return response
 
         if get_content_length(request):
             content_type = request._content_type
-            if content_type in serializers:
+            # Decoders that support it read the body as a stream
+            if serializers.supports_request_decoding(content_type):
+                options = self.get_request_decoder_options(request,
+                                                           content_type)
+                request.data = serializers.decode_request(content_type,
+                                                          request, **options)
+            elif content_type in serializers:
                 if isinstance(request.body, bytes):
                     data = serializers.decode(content_type,
                                               request.body.decode('utf-8'))
@@ -832,7 +1918,10 @@ class Resource(object):
         # Set content to nothing after no content is handled since it must
         # retain the properties of the GET response
         if request.method == methods.HEAD:
-            response.content = ''
+            if getattr(response, 'streaming', False):
+                response.streaming_content = []
+            else:
+                response.content = ''
 
         if request.method in (methods.GET, methods.HEAD):
             self.response_cache_control(request, response)
@@ -843,8 +1932,120 @@ class Resource(object):
             if self.use_last_modified:
                 self.set_last_modified(request, response)
 
+        if self.delta_encoding and request.method == methods.GET:
+            response = self.process_delta(request, response)
+
+        if self.use_ranges and request.method == methods.GET:
+            self.process_ranges(request, response)
+
+        self.set_rate_limit_headers(request, response)
+
         return response
 
+    # Keeps the representation of a complete JSON response and responds
+    # with a delta if the client requested one for a version that is known.
+    def process_delta(self, request, response):
+        if response.status_code != codes.ok or \
+                getattr(response, 'streaming', False) or \
+                'ETag' not in response:
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0]
+
+        if content_type != 'application/json':
+            return response
+
+        store = self.get_delta_store(request)
+        etag = parse_etags(response['ETag'])[0]
+        store.set(self.get_delta_key(request, etag), response.content,
+                  self.delta_timeout)
+
+        instance_manipulations = request.META.get('HTTP_A_IM', '')
+        instance_manipulations = [value.split(';')[0].strip().lower()
+                                  for value in
+                                  instance_manipulations.split(',')]
+
+        if 'json-patch' not in instance_manipulations or \
+                'HTTP_IF_NONE_MATCH' not in request.META:
+            return response
+
+        candidates = parse_etag_list(request.META['HTTP_IF_NONE_MATCH'])
+
+        if candidates == '*':
+            return response
+
+        for base, weak in candidates:
+            content = store.get(self.get_delta_key(request, base))
+
+            if content is None or weak:
+                continue
+
+            current = serializers.decode('application/json',
+                                         response.content.decode('utf-8'))
+            previous = serializers.decode('application/json',
+                                          content.decode('utf-8'))
+            delta = serializers.encode(JSON_PATCH, diff(previous, current))
+
+            if len(delta) >= len(response.content):
+                break
+
+            delta_response = HttpResponse(delta, status=codes.im_used,
+                                          content_type=JSON_PATCH)
+
+            for header in ('ETag', 'Last-Modified'):
+                if header in response:
+                    delta_response[header] = response[header]
+
+            delta_response['IM'] = 'json-patch'
+            delta_response['Delta-Base'] = quote_etag(base)
+            # Caches that do not support delta encoding must not store it
+            delta_response['Cache-Control'] = 'no-store, im'
+
+            return delta_response
+
+        return response
+
+    # Returns the key a representation is stored under for computing deltas.
+    # Unlike the ETag key, it does not include the version of the cache
+    # dependencies since the base a client has is from a previous version.
+    def get_delta_key(self, request, etag):
+        path = hashlib.md5('\n'.join([
+            request.get_full_path(), self.get_accept_type(request) or '',
+        ]).encode('utf-8'))
+        return 'restlib2:delta:{0}.{1}:{2}:{3}'.format(
+            self.__module__, self.__class__.__name__, path.hexdigest(), etag)
+
+    # Returns the bounded store representations are kept in for computing
+    # deltas. It is in-process by default, so a delta is only returned if
+    # the previous version was served by the same process.
+    def get_delta_store(self, request):
+        return representations
+
+    # Responds with the requested byte ranges of a complete response.
+    # Ranges of file objects are already handled when rendering.
+    def process_ranges(self, request, response):
+        if response.status_code != codes.ok or \
+                getattr(response, 'streaming', False):
+            return
+
+        response['Accept-Ranges'] = 'bytes'
+
+        if 'HTTP_RANGE' not in request.META:
+            return
+
+        etag = None
+        if 'ETag' in response:
+            etag = parse_etag_list(response['ETag'])[0][0]
+
+        if not self.range_applies(request, etag,
+                                  response.get('Last-Modified')):
+            return
+
+        content = response.content
+        self.apply_ranges(request, response,
+                          lambda start, end: content[start:end + 1],
+                          len(content))
+
 
 class TemplateResource(TemplateResponseMixin, Resource):
     pass
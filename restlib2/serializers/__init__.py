@@ -1,5 +1,5 @@
 import warnings
-from . import _json, _plain, _octet, _xml, _www
+from . import _json, _plain, _octet, _xml, _www, _multipart
 
 try:
     str = unicode
@@ -31,6 +31,21 @@ class Library(object):
             raise TypeError('Content is already a string, cannot encode.')
         return self.library[mimetype].encode(data, **kwargs)
 
+    def iterencode(self, mimetype, data, **kwargs):
+        """Encodes the data as an iterable of chunks. Encoders that do not
+        support incremental encoding produce a single chunk.
+        """
+        if mimetype not in self.library:
+            raise KeyError('Encoder for %s not registered' % mimetype)
+        if isinstance(data, str):
+            raise TypeError('Content is already a string, cannot encode.')
+
+        encoder = self.library[mimetype]
+
+        if hasattr(encoder, 'iterencode'):
+            return encoder.iterencode(data, **kwargs)
+        return iter([encoder.encode(data, **kwargs)])
+
     def decode(self, mimetype, data, **kwargs):
         if mimetype not in self.library:
             raise KeyError('Decoder for %s not registered' % mimetype)
@@ -38,6 +53,15 @@ class Library(object):
             raise TypeError('Content is not a string, cannot decode.')
         return self.library[mimetype].decode(data, **kwargs)
 
+    def decode_request(self, mimetype, request, **kwargs):
+        """Decodes the body of the request by reading it as a stream rather
+        than loading it into memory first. Only supported by decoders that
+        implement `decode_request`.
+        """
+        if not self.supports_request_decoding(mimetype):
+            raise KeyError('Request decoder for %s not registered' % mimetype)
+        return self.library[mimetype].decode_request(request, **kwargs)
+
     def supports_encoding(self, mimetype):
         if mimetype not in self:
             return None
@@ -48,6 +72,11 @@ class Library(object):
             return None
         return hasattr(self.library[mimetype], 'decode')
 
+    def supports_request_decoding(self, mimetype):
+        if mimetype not in self:
+            return None
+        return hasattr(self.library[mimetype], 'decode_request')
+
 serializers = Library()
 
 # register built-in encoders/decoders
@@ -56,3 +85,6 @@ serializers.register('application/octet-stream', _octet.OctetStream)
 serializers.register('text/plain', _plain.PlainText)
 serializers.register('application/json', _json.JSON)
 serializers.register('application/xml', _xml.DataOrientedXML)
+serializers.register('multipart/form-data', _multipart.Multipart)
+serializers.register('application/json-patch+json', _json.JSON)
+serializers.register('application/merge-patch+json', _json.JSON)
@@ -27,6 +27,18 @@ class JSON(object):
         encoder = self.encoder_class(**options)
         return encoder.encode(data)
 
+    def iterencode(self, data, options=None, **kwargs):
+        if options is None:
+            options = self.encode_options
+
+        # The C accelerated encoder is only used for one-shot encoding of
+        # non-indented output which is faster than incremental encoding.
+        if options.get('indent') is None:
+            return iter([self.encode(data, options)])
+
+        encoder = self.encoder_class(**options)
+        return encoder.iterencode(data)
+
     def decode(self, data, options=None, **kwargs):
         if options is None:
             options = self.decode_options
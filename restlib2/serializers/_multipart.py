@@ -0,0 +1,154 @@
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http.multipartparser import MultiPartParser
+from django.utils.datastructures import MultiValueDict
+from ..streams import LimitedInput, RequestEntityTooLarge
+
+
+class SpooledUploadHandler(FileUploadHandler):
+    """Writes uploaded files to a `SpooledTemporaryFile` which is kept in
+    memory up to `spool_size` bytes and moved to disk beyond that. Raises
+    `RequestEntityTooLarge` once a file exceeds `max_size` bytes.
+    """
+    def __init__(self, request=None, spool_size=None, max_size=None):
+        super(SpooledUploadHandler, self).__init__(request)
+        self.spool_size = spool_size
+        self.max_size = max_size
+
+    def new_file(self, *args, **kwargs):
+        super(SpooledUploadHandler, self).new_file(*args, **kwargs)
+        self.file = SpooledTemporaryFile(max_size=self.spool_size)
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+
+        if self.max_size and self.size > self.max_size:
+            self.file.close()
+            raise RequestEntityTooLarge('File {0} exceeds {1} bytes'
+                                        .format(self.file_name, self.max_size))
+
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        return UploadedFile(file=self.file, name=self.file_name,
+                            content_type=self.content_type, size=file_size,
+                            charset=self.charset)
+
+
+class MultipartData(object):
+    """Lazily parsed `multipart/form-data` body. The body is only read when
+    the data is first accessed, so handlers that do not use it never pay
+    for parsing it. Fields and files are available by name as with a
+    `MultiValueDict`, or separately as `fields` and `files`.
+    """
+    def __init__(self, parse):
+        self._parse = parse
+        self._data = None
+
+    def _setup(self):
+        if self._data is None:
+            self._fields, self._files = self._parse()
+
+            data = MultiValueDict()
+
+            for key, values in self._fields.lists():
+                data.setlist(key, list(values))
+
+            for key, values in self._files.lists():
+                data.setlist(key, data.getlist(key) + list(values))
+
+            self._data = data
+
+        return self._data
+
+    @property
+    def fields(self):
+        self._setup()
+        return self._fields
+
+    @property
+    def files(self):
+        self._setup()
+        return self._files
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._setup(), name)
+
+    def __getitem__(self, key):
+        return self._setup()[key]
+
+    def __contains__(self, key):
+        return key in self._setup()
+
+    def __iter__(self):
+        return iter(self._setup())
+
+    def __len__(self):
+        return len(self._setup())
+
+
+class Multipart(object):
+    """Streaming `multipart/form-data` decoder built on Django's parser. The
+    request body is read in chunks and files are spooled to disk once they
+    are larger than `spool_size` bytes, which defaults to Django's
+    `FILE_UPLOAD_MAX_MEMORY_SIZE` setting. `max_part_size` limits the size
+    of each file and `max_size` the size of the whole body, exceeding
+    either results in a _413 Request Entity Too Large_ response.
+
+    The attributes are the defaults for all resources. Resources set their
+    own with `request_decoder_options`, which are passed as keyword
+    arguments to `decode_request`.
+    """
+    spool_size = None
+    max_part_size = None
+    max_size = None
+
+    def decode_request(self, request, spool_size=None, max_part_size=None,
+                       max_size=None, **kwargs):
+        if spool_size is None:
+            spool_size = self.spool_size
+
+        if max_part_size is None:
+            max_part_size = self.max_part_size
+
+        if max_size is None:
+            max_size = self.max_size
+
+        if spool_size is None:
+            spool_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+
+        def parse():
+            # Already parsed by Django, e.g. by accessing `request.POST`
+            if hasattr(request, '_files'):
+                return request._post, request._files
+
+            # The body may have been read already, e.g. by a middleware
+            if hasattr(request, '_body'):
+                stream = BytesIO(request._body)
+            else:
+                stream = request
+
+            if max_size:
+                stream = LimitedInput(stream, max_size)
+
+            handlers = [SpooledUploadHandler(request, spool_size,
+                                             max_part_size)]
+
+            parser = MultiPartParser(request.META, stream, handlers,
+                                     request.encoding)
+            fields, files = parser.parse()
+
+            # The stream has been consumed, so `request.POST` and
+            # `request.FILES` would otherwise be empty.
+            request._post, request._files = fields, files
+
+            return fields, files
+
+        return MultipartData(parse)
@@ -0,0 +1,39 @@
+class RequestEntityTooLarge(Exception):
+    """Raised when more bytes than allowed are read from a request body.
+
+    This intentionally does not derive from `IOError` which Django converts
+    into an `UnreadablePostError` when reading the body.
+    """
+
+
+class LimitedInput(object):
+    """Wraps the input stream of a request and raises `RequestEntityTooLarge`
+    as soon as more than `limit` bytes have been read, so at most
+    `limit + 1` bytes are read from it. This does not depend on the stream
+    being limited to the `Content-Length` already, as `WSGIRequest` does.
+    """
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.remaining = limit
+
+    def _count(self, data):
+        self.remaining -= len(data)
+
+        if self.remaining < 0:
+            raise RequestEntityTooLarge('Request body exceeds {0} bytes'
+                                        .format(self.limit))
+
+        return data
+
+    # One byte past the limit is read to detect bodies that exceed it
+    def _size(self, size):
+        if size is None or size < 0:
+            return self.remaining + 1
+        return min(size, self.remaining + 1)
+
+    def read(self, size=None):
+        return self._count(self.stream.read(self._size(size)))
+
+    def readline(self, size=None):
+        return self._count(self.stream.readline(self._size(size)))
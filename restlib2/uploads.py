@@ -0,0 +1,359 @@
+import os
+import re
+import json
+import uuid
+import base64
+import tempfile
+from django.http import HttpResponse
+from .http import codes, methods
+from .resources import Resource
+from .streams import RequestEntityTooLarge
+
+# Version of the tus protocol that is implemented
+TUS_VERSION = '1.0.0'
+
+# Content type of `PATCH` request bodies
+OFFSET_CONTENT_TYPE = 'application/offset+octet-stream'
+
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def parse_upload_metadata(value):
+    """Parses an `Upload-Metadata` header, a comma separated list of keys
+    and optional base64 encoded values, into a dict.
+    """
+    metadata = {}
+
+    for pair in value.split(','):
+        key, _, encoded = pair.strip().partition(' ')
+
+        if not key:
+            continue
+
+        try:
+            metadata[key] = base64.b64decode(encoded.strip().encode('ascii'))
+        except (TypeError, ValueError):
+            raise ValueError('Invalid metadata value for {0}'.format(key))
+
+    return metadata
+
+
+class Upload(object):
+    """An upload in the spool directory. The data is appended to a file named
+    by the upload id and the declared length and metadata are kept next to
+    it in a JSON file. The offset of the upload is the size of the data
+    file.
+    """
+    def __init__(self, spool_dir, id, length=None, metadata=None):
+        self.spool_dir = spool_dir
+        self.id = id
+        self.length = length
+        self.metadata = metadata or {}
+
+    @property
+    def path(self):
+        return os.path.join(self.spool_dir, self.id)
+
+    @property
+    def info_path(self):
+        return self.path + '.json'
+
+    @property
+    def offset(self):
+        return os.path.getsize(self.path)
+
+    @property
+    def complete(self):
+        return self.offset == self.length
+
+    @classmethod
+    def create(cls, spool_dir, length, metadata=None):
+        if not os.path.isdir(spool_dir):
+            try:
+                os.makedirs(spool_dir)
+            # Created concurrently
+            except OSError:
+                if not os.path.isdir(spool_dir):
+                    raise
+
+        upload = cls(spool_dir, uuid.uuid4().hex, length, metadata)
+
+        open(upload.path, 'wb').close()
+
+        info = {
+            'length': length,
+            'metadata': dict((key, base64.b64encode(value).decode('ascii'))
+                             for key, value in upload.metadata.items()),
+        }
+
+        with open(upload.info_path, 'w') as f:
+            json.dump(info, f)
+
+        return upload
+
+    @classmethod
+    def load(cls, spool_dir, id):
+        "Returns the upload or `None` if it does not exist."
+        if not UPLOAD_ID.match(id or ''):
+            return
+
+        upload = cls(spool_dir, id)
+
+        try:
+            with open(upload.info_path) as f:
+                info = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        upload.length = info['length']
+        upload.metadata = dict((key, base64.b64decode(value.encode('ascii')))
+                               for key, value in info['metadata'].items())
+        return upload
+
+    def append(self, stream, block_size, fsync_size, limit=None):
+        """Appends the data read from `stream` and returns the number of
+        bytes written. The file is synced to disk once at least
+        `fsync_size` bytes have been written since the last sync and once
+        more when done, also if reading the stream fails, e.g. because the
+        client disconnected, so all data received is kept. If the stream
+        has more than `limit` bytes, the bytes up to the limit are written
+        before `RequestEntityTooLarge` is raised.
+        """
+        written = unsynced = 0
+
+        with open(self.path, 'ab') as f:
+            try:
+                while True:
+                    size = block_size
+
+                    # One byte past the limit is read to detect streams
+                    # that exceed it
+                    if limit is not None:
+                        size = min(size, limit - written + 1)
+
+                    block = stream.read(size)
+
+                    if not block:
+                        break
+
+                    exceeded = limit is not None and \
+                        written + len(block) > limit
+
+                    if exceeded:
+                        block = block[:limit - written]
+
+                    f.write(block)
+                    written += len(block)
+                    unsynced += len(block)
+
+                    if exceeded:
+                        raise RequestEntityTooLarge(
+                            'Upload exceeds {0} bytes'.format(limit))
+
+                    if unsynced >= fsync_size:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        unsynced = 0
+            finally:
+                if unsynced:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        return written
+
+    def open(self):
+        "Opens the uploaded data for reading."
+        return open(self.path, 'rb')
+
+    def delete(self):
+        for path in (self.path, self.info_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# ## Upload Resource
+# Resumable uploads of large bodies following the core of the [tus][0]
+# protocol and its _creation_ and _termination_ extensions.
+#
+# A `POST` request with an `Upload-Length` header creates an upload and
+# responds with its location. The data is sent in one or more `PATCH`
+# requests to that location with an `Upload-Offset` header that must match
+# the number of bytes received so far. If a transfer is interrupted, the
+# client sends a `HEAD` request to get the current `Upload-Offset` and
+# resumes from there. Once all data has been received, `upload_complete` is
+# called.
+#
+# The resource must be routed with an optional `upload_id` argument, e.g.
+# `^uploads/(?:(?P<upload_id>[0-9a-f]{32})/)?$`.
+#
+# [0]: http://tus.io/protocols/resumable-upload.html
+class UploadResource(Resource):
+    supported_content_types = (OFFSET_CONTENT_TYPE,)
+    supported_patch_types = (OFFSET_CONTENT_TYPE,)
+
+    # The state of an upload changes with every request
+    use_etags = False
+    use_last_modified = False
+
+    # Directory uploads are written to. Defaults to a `restlib2-uploads`
+    # directory in the system's temporary directory.
+    spool_dir = None
+
+    # Maximum size of a single upload in bytes.
+    max_upload_length = None
+
+    # Size of the blocks the request body is read and written in.
+    upload_block_size = 64 * 1024
+
+    # Number of bytes written between syncs to disk. Syncing every block
+    # would limit the throughput to the disk's sync rate.
+    upload_fsync_size = 4 * 1024 * 1024
+
+    # Number of seconds an upload is locked while data is appended, in case
+    # the worker dies before releasing it.
+    upload_lock_timeout = 60 * 60
+
+    def get_spool_dir(self, request):
+        if self.spool_dir is not None:
+            return self.spool_dir
+        return os.path.join(tempfile.gettempdir(), 'restlib2-uploads')
+
+    def get_upload(self, request, upload_id):
+        return Upload.load(self.get_spool_dir(request), upload_id)
+
+    # Returns the URL of an upload relative to the creation URL.
+    def get_upload_url(self, request, upload):
+        return request.build_absolute_uri(upload.id + '/')
+
+    # Called once all data of an upload has been received. The data is
+    # available with `upload.open()` and the metadata sent by the client
+    # as `upload.metadata`. The upload is kept in the spool directory, call
+    # `upload.delete()` when done with it. If a response is returned, it is
+    # used as the response to the final `PATCH` request.
+    def upload_complete(self, request, upload):
+        pass
+
+    def process_response(self, request, response):
+        response = super(UploadResource, self).process_response(request,
+                                                                response)
+        response['Tus-Resumable'] = TUS_VERSION
+        return response
+
+    def options(self, request, *args, **kwargs):
+        response = super(UploadResource, self).options(request, *args,
+                                                       **kwargs)
+        response['Tus-Version'] = TUS_VERSION
+        response['Tus-Extension'] = 'creation,termination'
+
+        if self.max_upload_length:
+            response['Tus-Max-Size'] = self.max_upload_length
+
+        return response
+
+    def post(self, request, upload_id=None):
+        if upload_id is not None:
+            response = HttpResponse(status=codes.method_not_allowed)
+            response['Allow'] = ', '.join(
+                method for method in self.allowed_methods
+                if method != methods.POST)
+            return response
+
+        try:
+            length = int(request.META['HTTP_UPLOAD_LENGTH'])
+            metadata = parse_upload_metadata(
+                request.META.get('HTTP_UPLOAD_METADATA', ''))
+        except (KeyError, ValueError):
+            return HttpResponse(status=codes.bad_request)
+
+        if length < 0:
+            return HttpResponse(status=codes.bad_request)
+
+        if self.max_upload_length and length > self.max_upload_length:
+            return HttpResponse(status=codes.request_entity_too_large)
+
+        upload = Upload.create(self.get_spool_dir(request), length, metadata)
+
+        # Empty uploads are complete once created
+        if upload.complete:
+            self.upload_complete(request, upload)
+
+        response = HttpResponse(status=codes.created)
+        response['Location'] = self.get_upload_url(request, upload)
+        return response
+
+    # Reports the state of the upload. The `HEAD` response is used by
+    # clients to resume an upload, `GET` responds with the state in the
+    # body as well.
+    def get(self, request, upload_id=None):
+        upload = self.get_upload(request, upload_id)
+
+        if upload is None:
+            return HttpResponse(status=codes.not_found)
+
+        response = self.render(request, {
+            'offset': upload.offset,
+            'length': upload.length,
+        })
+        response['Cache-Control'] = 'no-store'
+        response['Upload-Offset'] = upload.offset
+        response['Upload-Length'] = upload.length
+        return response
+
+    def patch(self, request, upload_id=None):
+        upload = self.get_upload(request, upload_id)
+
+        if upload is None:
+            return HttpResponse(status=codes.not_found)
+
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        except (KeyError, ValueError):
+            return HttpResponse(status=codes.bad_request)
+
+        # Concurrent appends to the same upload are rejected
+        cache = self.get_cache(request, None)
+        lock_key = 'restlib2:upload:{0}:lock'.format(upload.id)
+
+        if not cache.add(lock_key, 1, self.upload_lock_timeout):
+            return HttpResponse(status=codes.conflict)
+
+        try:
+            if offset != upload.offset:
+                return HttpResponse(status=codes.conflict)
+
+            try:
+                written = upload.append(request, self.upload_block_size,
+                                        self.upload_fsync_size,
+                                        upload.length - offset)
+            # Data up to the declared length is kept
+            except RequestEntityTooLarge:
+                response = HttpResponse(
+                    status=codes.request_entity_too_large)
+                response['Upload-Offset'] = upload.offset
+                return response
+        finally:
+            cache.delete(lock_key)
+
+        response = None
+
+        # Only the request completing the upload calls the hook, e.g. not
+        # a retried final request without data
+        if written and upload.complete:
+            response = self.upload_complete(request, upload)
+
+        if response is None:
+            response = HttpResponse(status=codes.no_content)
+
+        response['Upload-Offset'] = upload.offset
+        return response
+
+    def delete(self, request, upload_id=None):
+        upload = self.get_upload(request, upload_id)
+
+        if upload is None:
+            return HttpResponse(status=codes.not_found)
+
+        upload.delete()
+        return HttpResponse(status=codes.no_content)
@@ -21,3 +21,8 @@ class Hacker(models.Model):
     def signature(self):
         return '{0}  <{1}>  {2}'.format(self.user.get_full_name(),
                 self.user.email, self.website)
+
+
+class Note(models.Model):
+    text = models.CharField(max_length=100)
+    version = models.IntegerField(default=1)
@@ -1,14 +1,47 @@
+import json
+import six
 from calendar import timegm
-from django.test.client import RequestFactory
+from django.test.client import RequestFactory, FakePayload
 from django.test import TestCase
+from django.utils.unittest import skipIf
 from django.conf.urls import patterns, url
-from restlib2 import params
-from restlib2.resources import Resource
-from restlib2.mixins import TemplateResponseMixin
+from restlib2 import params, patch
+from restlib2.resources import Resource, StreamingHttpResponse
+from restlib2.batch import BatchResource
+from restlib2.eventstream import EventStreamResource
+from restlib2.events import broker
+from restlib2.uploads import UploadResource
+from restlib2.mixins import TemplateResponseMixin, VersionedResourceMixin
 from restlib2.http import codes
 from restlib2.structures import AttrDict
 
 
+def generic_request(factory, method, path, data='',
+                    content_type='application/octet-stream', **extra):
+    """Builds a request with an arbitrary method and body. Django 1.4 has
+    no `RequestFactory.generic` and 1.5 has no `RequestFactory.patch`.
+    """
+    if hasattr(factory, 'generic'):
+        return factory.generic(method, path, data, content_type, **extra)
+
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+
+    path, _, query_string = path.partition('?')
+
+    environ = {
+        'CONTENT_LENGTH': len(data),
+        'CONTENT_TYPE': content_type,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'REQUEST_METHOD': method,
+        'wsgi.input': FakePayload(data),
+    }
+    environ.update(extra)
+
+    return factory.request(**environ)
+
+
 class StructuresTestCase(TestCase):
     def test_attrdict(self):
         attrs = AttrDict('Foo', {
@@ -63,6 +96,47 @@ class ResourceTestCase(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertEqual(response.content, b'')
 
+    def test_head_skips_encoding(self):
+        "HEAD requests only encode the content if the ETag requires it."
+        class UnencodableResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return object()
+
+            def calculate_etag(self, request):
+                return 'v1'
+
+        request = self.factory.head('/')
+        response = UnencodableResource()(request)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(response.content, b'')
+
+        class EtagResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return {'foo': 'bar'}
+
+        resource = EtagResource()
+        get = resource(self.factory.get('/'))
+        head = resource(self.factory.head('/'))
+        self.assertEqual(head['ETag'], get['ETag'])
+        self.assertEqual(head['Content-Length'], str(len(get.content)))
+        self.assertEqual(head.content, b'')
+
+        # Overridden HEAD handlers returning no content do not get the ETag
+        # of an empty body
+        class HeadResource(EtagResource):
+            def head(self, request):
+                pass
+
+        head = HeadResource()(self.factory.head('/'))
+        self.assertEqual(head.status_code, codes.ok)
+        self.assertFalse('ETag' in head)
+
     def test_default_patch(self):
         # Resources supporting PATCH requests should have an additional
         # header in the response from an OPTIONS request
@@ -211,6 +285,422 @@ class ResourceTestCase(TestCase):
         self.assertEqual(response.status_code, codes.request_entity_too_large)
         self.assertEqual(response['Content-Type'], 'application/json')
 
+    def test_request_entity_too_large_streaming(self):
+        "The limit is enforced while reading bodies of unknown length."
+        import io
+
+        class TinyResource(Resource):
+            supported_content_types = ('application/json', 'text/plain')
+            max_request_entity_length = {'text/plain': 100, '*/*': 20}
+
+            def post(self, request, *args, **kwargs):
+                request.body
+
+        resource = TinyResource()
+        body = b'{"message": "hello world"}'
+
+        def request(content_type):
+            request = self.factory.post('/', data=body,
+                                        content_type=content_type)
+            # Mimic a client that understates the length of the body
+            request.META['CONTENT_LENGTH'] = '5'
+            request._stream = io.BytesIO(body)
+            return request
+
+        response = resource(request('application/json'))
+        self.assertEqual(response.status_code, codes.request_entity_too_large)
+
+        response = resource(request('text/plain'))
+        self.assertEqual(response.status_code, codes.no_content)
+
+    def test_multipart(self):
+        "Multipart bodies are parsed lazily with large files spooled."
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        parsed = []
+
+        class UploadResource(Resource):
+            supported_content_types = ('multipart/form-data',)
+            request_decoder_options = {
+                'multipart/form-data': {'spool_size': 10},
+            }
+
+            def post(self, request):
+                parsed.append(request._read_started)
+                parsed.append((request.data['name'],
+                               request.data['file'].read(),
+                               request.data['file'].file._rolled))
+
+        def request():
+            return self.factory.post('/', data={
+                'name': 'foo',
+                'file': SimpleUploadedFile('foo.txt', b'x' * 100),
+            })
+
+        response = UploadResource()(request())
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(parsed, [False, ('foo', b'x' * 100, True)])
+
+        # Each resource has its own limits
+        class LimitedUploadResource(UploadResource):
+            request_decoder_options = {
+                'multipart/form-data': {'max_part_size': 50},
+            }
+
+        response = LimitedUploadResource()(request())
+        self.assertEqual(response.status_code, codes.request_entity_too_large)
+
+        response = UploadResource()(request())
+        self.assertEqual(response.status_code, codes.no_content)
+
+    def test_patch_document(self):
+        "PATCH requests apply JSON Patch and Merge Patch documents."
+        document = {'name': 'foo', 'tags': ['a'], 'count': 1}
+        changed = []
+
+        class PatchResource(Resource):
+            supported_patch_types = (patch.JSON_PATCH, patch.MERGE_PATCH)
+
+            def patch(self, request):
+                doc, fields = self.patch_document(request, document)
+                changed.append(patch.changes(doc, fields))
+
+        resource = PatchResource()
+
+        request = generic_request(self.factory, 'PATCH', '/', json.dumps([
+            {'op': 'test', 'path': '/count', 'value': 1},
+            {'op': 'add', 'path': '/tags/-', 'value': 'b'},
+        ]), content_type=patch.JSON_PATCH)
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(changed, [{'tags': ['a', 'b']}])
+
+        request = generic_request(self.factory, 'PATCH', '/',
+                                  '{"name": null, "count": 2}',
+                                  content_type=patch.MERGE_PATCH)
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(changed[-1], {'name': None, 'count': 2})
+        self.assertEqual(document, {'tags': ['a', 'b'], 'count': 2})
+
+        # Failed tests conflict and invalid patches are rejected, both
+        # without changing the document
+        for operations, status in [
+                ([{'op': 'remove', 'path': '/count'},
+                  {'op': 'test', 'path': '/tags/0', 'value': 'b'}],
+                 codes.conflict),
+                ([{'op': 'remove', 'path': '/count'},
+                  {'op': 'remove', 'path': '/missing'}],
+                 codes.unprocessable_entity)]:
+            request = generic_request(self.factory, 'PATCH', '/',
+                                      json.dumps(operations),
+                                      content_type=patch.JSON_PATCH)
+            response = resource(request)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(document, {'tags': ['a', 'b'], 'count': 2})
+
+        request = generic_request(self.factory, 'PATCH', '/', '{}',
+                                  content_type='application/json')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.unsupported_media_type)
+
+    def test_versioned_update(self):
+        "Writes compare-and-swap the version used as the ETag."
+        from .models import Note
+
+        note = Note.objects.create(text='foo')
+        concurrent = []
+
+        class NoteResource(VersionedResourceMixin, Resource):
+            model = Note
+            cache_responses = True
+            cache_max_age = 60
+            cache_dependencies = (Note,)
+
+            def get(self, request, pk):
+                return {'text': Note.objects.get(pk=pk).text}
+
+            def put(self, request, pk):
+                # Mimic a write that happened after the precondition was
+                # checked
+                if concurrent:
+                    Note.objects.filter(pk=pk).update(version=10)
+                self.update_version(request, {'text': request.data['text']},
+                                    pk=pk)
+
+        resource = NoteResource()
+
+        def put(etag=None):
+            headers = {'HTTP_IF_MATCH': etag} if etag else {}
+            request = self.factory.put('/', data='{"text": "bar"}',
+                                       content_type='application/json',
+                                       **headers)
+            return resource(request, pk=note.pk)
+
+        def get():
+            response = resource(self.factory.get('/'), pk=note.pk)
+            return json.loads(response.content.decode('utf-8'))['text']
+
+        response = resource(self.factory.get('/'), pk=note.pk)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(get(), 'foo')
+
+        self.assertEqual(put().status_code, codes.precondition_required)
+
+        response = put('"1"')
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(Note.objects.get(pk=note.pk).version, 2)
+        self.assertEqual(Note.objects.get(pk=note.pk).text, 'bar')
+
+        # Cached responses depending on the note are invalidated
+        self.assertEqual(get(), 'bar')
+
+        self.assertEqual(put('"1"').status_code, codes.precondition_failed)
+
+        concurrent.append(True)
+        response = put('"2"')
+        self.assertEqual(response.status_code, codes.precondition_failed)
+        self.assertFalse('ETag' in response)
+        self.assertEqual(Note.objects.get(pk=note.pk).version, 10)
+
+    def test_delta_encoding(self):
+        "Polling clients get a JSON Patch from their version."
+        items = [{'id': i, 'name': 'item {0}'.format(i)} for i in range(50)]
+
+        class CollectionResource(Resource):
+            use_etags = True
+            delta_encoding = True
+
+            def get(self, request):
+                return items
+
+            def calculate_etag(self, request):
+                return str(len(items))
+
+        resource = CollectionResource()
+
+        response = resource(self.factory.get('/'))
+        self.assertEqual(response.status_code, codes.ok)
+        etag = response['ETag']
+        previous = json.loads(response.content.decode('utf-8'))
+
+        items.insert(0, {'id': 50, 'name': 'new'})
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_A_IM='json-patch')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.im_used)
+        self.assertEqual(response['IM'], 'json-patch')
+        self.assertEqual(response['Delta-Base'], etag)
+        self.assertEqual(response['ETag'], '"51"')
+
+        operations = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(operations, [{'op': 'add', 'path': '/0',
+                                       'value': items[0]}])
+        self.assertEqual(patch.apply_json_patch(previous, operations)[0],
+                         items)
+
+        # Unknown versions get the full representation
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"1"',
+                                   HTTP_A_IM='json-patch')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.ok)
+
+    def test_delta_encoding_dependencies(self):
+        "Deltas are computed from bases of previous dependency versions."
+        from .models import Tag
+
+        class TagsResource(Resource):
+            use_etags = True
+            delta_encoding = True
+            cache_dependencies = (Tag,)
+
+            def get(self, request):
+                return [{'id': tag.pk, 'name': tag.name}
+                        for tag in Tag.objects.order_by('pk')]
+
+        for i in range(20):
+            Tag.objects.create(name='tag {0}'.format(i))
+
+        resource = TagsResource()
+
+        response = resource(self.factory.get('/'))
+        etag = response['ETag']
+        previous = json.loads(response.content.decode('utf-8'))
+
+        Tag.objects.create(name='new')
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_A_IM='json-patch')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.im_used)
+        self.assertNotEqual(response['ETag'], etag)
+
+        operations = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(patch.apply_json_patch(previous, operations)[0],
+                         resource.get(request))
+
+    def test_long_poll(self):
+        "Conditional requests can wait for the entity to change."
+        import time
+        import threading
+
+        state = {'version': 1}
+
+        class PollResource(Resource):
+            use_etags = True
+            long_poll_timeout = 5
+
+            def get(self, request):
+                return state
+
+            def calculate_etag(self, request):
+                return str(state['version'])
+
+            def get_event_tags(self, request):
+                return ['test:poll']
+
+        resource = PollResource()
+
+        def change():
+            time.sleep(0.1)
+            state['version'] = 2
+            broker.publish(['test:poll'])
+
+        thread = threading.Thread(target=change)
+        thread.start()
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"1"',
+                                   HTTP_PREFER='wait=4')
+        start = time.time()
+        response = resource(request)
+        thread.join()
+
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertTrue(time.time() - start < 2)
+
+        # Without changes the request times out
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"2"',
+                                   HTTP_PREFER='wait=0.1')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.not_modified)
+
+        # Clients that do not ask to wait are responded to immediately
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"2"')
+        start = time.time()
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.not_modified)
+        self.assertTrue(time.time() - start < 0.1)
+
+    def test_coalesce_requests(self):
+        "Concurrent identical requests share a single handler execution."
+        import time
+        import threading
+        from restlib2.cache import SingleFlight
+
+        calls = []
+
+        class CoalescedResource(Resource):
+            coalesce_requests = True
+            coalescer = SingleFlight()
+
+            def get(self, request):
+                calls.append(1)
+                time.sleep(0.3)
+                return {'calls': len(calls)}
+
+        resource = CoalescedResource()
+        responses = []
+
+        def fetch():
+            responses.append(resource(self.factory.get('/')))
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(len(set(r.content for r in responses)), 1)
+        self.assertEqual(json.loads(responses[0].content.decode('utf-8')),
+                         {'calls': 1})
+        self.assertEqual(resource.coalescer.executions, 1)
+        self.assertEqual(resource.coalescer.saved, 4)
+
+        # Requests for other representations are not coalesced
+        resource(self.factory.get('/?page=2'))
+        self.assertEqual(len(calls), 2)
+
+        # Nor are requests with different credentials
+        class UserResource(CoalescedResource):
+            def get(self, request):
+                time.sleep(0.3)
+                return {'user': request.META['HTTP_AUTHORIZATION']}
+
+        resource = UserResource()
+        responses = {}
+
+        def fetch_as(user):
+            request = self.factory.get('/', HTTP_AUTHORIZATION=user)
+            responses[user] = json.loads(
+                resource(request).content.decode('utf-8'))
+
+        threads = [threading.Thread(target=fetch_as, args=(user,))
+                   for user in ('a', 'b')]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(responses, {'a': {'user': 'a'}, 'b': {'user': 'b'}})
+        self.assertEqual(resource.coalescer.saved, 4)
+
+    @skipIf(StreamingHttpResponse is None, 'Requires Django 1.5+')
+    def test_event_stream(self):
+        import threading
+
+        class CounterResource(EventStreamResource):
+            count = 0
+
+            def get_event_tags(self, request):
+                return ['test:counter']
+
+            def get_event(self, request, tags):
+                return {'count': self.count, 'tags': sorted(tags)}
+
+        resource = CounterResource()
+        request = self.factory.get('/', HTTP_ACCEPT='text/event-stream')
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        self.assertTrue(b'"count": 0' in next(stream))
+
+        def publish():
+            resource.count = 1
+            broker.publish(['test:counter'])
+
+        threading.Timer(0.1, publish).start()
+
+        event = next(stream).decode('utf-8')
+        self.assertTrue(event.startswith('id: '))
+        data = ''.join(line[6:] for line in event.splitlines()
+                       if line.startswith('data: '))
+        self.assertEqual(json.loads(data),
+                         {'count': 1, 'tags': ['test:counter']})
+
+        response.close()
+
     def test_too_many_requests(self):
         """Test a global rate limiting implementation.
 
@@ -275,6 +765,87 @@ class ResourceTestCase(TestCase):
             self.assertEqual(response.status_code, codes.no_content)
             self.assertEqual(response['Content-Type'], 'application/json')
 
+    def test_too_many_requests_default(self):
+        "Test the built-in sliding window rate limiter."
+        from restlib2.ratelimit import LocalRateLimiter
+
+        class LimitedResource(Resource):
+            rate_limit_count = 2
+            rate_limit_seconds = 60
+
+            def get(self, request):
+                return {}
+
+        for limiter in (None, LocalRateLimiter()):
+            resource = LimitedResource(rate_limiter=limiter)
+            request = self.factory.get('/', REMOTE_ADDR=str(id(limiter)))
+
+            for remaining in (1, 0):
+                response = resource(request)
+                self.assertEqual(response.status_code, codes.ok)
+                self.assertEqual(response['X-RateLimit-Limit'], '2')
+                self.assertEqual(response['X-RateLimit-Remaining'],
+                                 str(remaining))
+
+            response = resource(request)
+            self.assertEqual(response.status_code, codes.too_many_requests)
+            self.assertTrue(0 < int(response['Retry-After']) <= 60)
+
+            # Other clients are counted separately
+            request = self.factory.get('/', REMOTE_ADDR='10.0.0.1')
+            response = resource(request)
+            self.assertEqual(response.status_code, codes.ok)
+
+    def test_batched_rate_limiter(self):
+        "Hits are aggregated per process and flushed in batches."
+        from django.core.cache import cache
+        from restlib2.ratelimit import BatchedRateLimiter
+
+        # Two limiters sharing a cache mimic two processes
+        first = BatchedRateLimiter(cache, flush_count=3, flush_interval=60)
+        second = BatchedRateLimiter(cache, flush_count=3, flush_interval=60)
+
+        # The first hit synchronizes with the shared cache, the following
+        # ones are flushed every third hit.
+        counts = [first.incr('batched', 60) for _ in range(4)]
+        self.assertEqual(counts, [1, 2, 3, 4])
+        self.assertEqual(cache.get('batched'), 4)
+
+        self.assertEqual(second.incr('batched', 60), 5)
+        self.assertEqual(first.incr('batched', 60), 5)
+        self.assertEqual(first.get('batched'), 5)
+
+        rate_limit = second.hit('client', 1, 60)
+        self.assertTrue(rate_limit.allowed)
+        rate_limit = second.hit('client', 1, 60)
+        self.assertFalse(rate_limit.allowed)
+
+    def test_batched_rate_limiter_flush(self):
+        "Flushing the hits of one key does not block other keys."
+        import time
+        import threading
+        from django.core.cache.backends.locmem import LocMemCache
+        from restlib2.ratelimit import BatchedRateLimiter
+
+        class SlowCache(LocMemCache):
+            def add(self, key, *args, **kwargs):
+                if key == 'slow':
+                    time.sleep(0.5)
+                return super(SlowCache, self).add(key, *args, **kwargs)
+
+        limiter = BatchedRateLimiter(SlowCache('slow', {}), flush_count=1)
+
+        thread = threading.Thread(target=limiter.incr, args=('slow', 60))
+        thread.start()
+        time.sleep(0.1)
+
+        start = time.time()
+        self.assertEqual(limiter.incr('fast', 60), 1)
+        self.assertTrue(time.time() - start < 0.3)
+
+        thread.join()
+        self.assertEqual(limiter.incr('slow', 60), 2)
+
     def test_precondition_required(self):
         """"Reject non-idempotent requests without the use of a conditional
         header."""
@@ -416,6 +987,562 @@ class ResourceTestCase(TestCase):
         self.assertEqual(response.status_code, codes.not_modified)
         self.assertEqual(response['Content-Type'], 'application/json')
 
+    def test_etag_hasher(self):
+        "ETags are hashed while encoding with a pluggable hasher."
+        import hashlib
+
+        class EtagResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return {'items': list(range(10000))}
+
+            def get_etag_hasher(self, request, response):
+                return hashlib.sha1()
+
+        resource = EtagResource()
+        response = resource(self.factory.get('/'))
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['ETag'], '"{0}"'.format(
+            hashlib.sha1(response.content).hexdigest()))
+
+        # The same ETag is produced when hashing the body afterwards
+        class TemplateEtagResource(EtagResource):
+            def get(self, request):
+                return response.content
+
+        template_response = TemplateEtagResource()(self.factory.get('/'))
+        self.assertEqual(template_response['ETag'], response['ETag'])
+
+    @skipIf(StreamingHttpResponse is None, 'Requires Django 1.5+')
+    def test_etag_hasher_streaming(self):
+        "Streaming responses are not hashed."
+        class StreamingResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return StreamingHttpResponse(iter([b'a', b'b']))
+
+        response = StreamingResource()(self.factory.get('/'))
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertFalse('ETag' in response)
+
+    def test_cheap_validators(self):
+        "Conditional requests are evaluated before the handler is called."
+        from datetime import datetime
+
+        calls = {'get': 0, 'etag': 0}
+        last_modified_date = datetime(2014, 1, 1, 12, 0, 0, 500)
+
+        class ValidatorResource(Resource):
+            use_etags = True
+            use_last_modified = True
+
+            def get(self, request, pk):
+                calls['get'] += 1
+                return {}
+
+            def calculate_etag(self, request, pk):
+                calls['etag'] += 1
+                return 'v1'
+
+            # URL arguments are passed for plain requests as well
+            def get_last_modified(self, request, pk):
+                return last_modified_date
+
+        resource = ValidatorResource()
+
+        response = resource(self.factory.get('/'), pk=1)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertTrue('Last-Modified' in response)
+        self.assertEqual(calls, {'get': 1, 'etag': 1})
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"v1"')
+        response = resource(request, pk=1)
+        self.assertEqual(response.status_code, codes.not_modified)
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(calls, {'get': 1, 'etag': 2})
+
+        # The Last-Modified header can be sent back as is
+        request = self.factory.get(
+            '/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        response = resource(request, pk=1)
+        self.assertEqual(response.status_code, codes.not_modified)
+        self.assertEqual(calls, {'get': 1, 'etag': 3})
+
+    def test_etag_registry(self):
+        "Repeated ETag registrations are written to the cache once."
+        import time
+        from django.core.cache.backends.locmem import LocMemCache
+        from restlib2.cache import EtagRegistry
+
+        class CountingCache(LocMemCache):
+            writes = 0
+
+            def set_many(self, data, *args, **kwargs):
+                self.writes += 1
+                super(CountingCache, self).set_many(data, *args, **kwargs)
+
+        cache = CountingCache('etags', {})
+        registry = EtagRegistry(flush_size=2, flush_interval=60)
+
+        for _ in range(10):
+            registry.register(cache, 'a')
+
+        # Pending keys are known locally, but not yet written
+        self.assertEqual(cache.writes, 0)
+        self.assertTrue(registry.is_registered(cache, 'a'))
+        self.assertFalse(registry.is_registered(cache, 'b'))
+
+        registry.register(cache, 'b')
+        self.assertEqual(cache.writes, 1)
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 1, 'b': 1})
+
+        # Another process sees the keys through the cache
+        self.assertTrue(EtagRegistry().is_registered(cache, 'b'))
+
+        # Pending keys are written after the flush interval even if no
+        # other key is registered
+        registry = EtagRegistry(flush_size=2, flush_interval=0.1)
+        registry.register(cache, 'c')
+        self.assertFalse('c' in cache)
+
+        for _ in range(20):
+            if 'c' in cache:
+                break
+            time.sleep(0.05)
+
+        self.assertTrue('c' in cache)
+        self.assertEqual(cache.writes, 2)
+
+    def test_tiered_cache(self):
+        "The local tier serves repeated and negative look ups."
+        from django.core.cache.backends.locmem import LocMemCache
+        from restlib2.cache import TieredCache
+
+        shared = LocMemCache('tiered', {})
+        cache = TieredCache(shared, max_size=2)
+
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        # Missing keys are cached negatively
+        self.assertFalse('b' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual((cache.misses, cache.negative_hits), (1, 1))
+
+        # Least recently used keys are evicted from the local tier
+        cache.set('c', 3)
+        cache.set('d', 4)
+        self.assertEqual(len(cache.local), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.get_many(['a', 'c', 'd', 'e']),
+                         {'a': 1, 'c': 3, 'd': 4})
+
+        class TieredResource(Resource):
+            use_etags = True
+            cache_backend = cache
+
+            def get(self, request):
+                return {}
+
+        response = TieredResource()(self.factory.get('/'))
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        response = TieredResource()(request)
+        self.assertEqual(response.status_code, codes.not_modified)
+
+    def test_response_cache(self):
+        "Responses are served from the server cache."
+        import time
+        from django.core.cache import cache
+
+        calls = []
+
+        class CachedResource(Resource):
+            cache_responses = True
+            cache_max_age = 60
+            response_cache_lock_timeout = 0.2
+
+            def get(self, request):
+                calls.append(1)
+                return {'count': len(calls)}
+
+        resource = CachedResource()
+        request = self.factory.get('/cached/')
+
+        first = resource(request)
+        second = resource(self.factory.get('/cached/'))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Cache-Control'], 'max-age=60')
+
+        # Other URLs and representations are cached separately
+        resource(self.factory.get('/cached/?page=2'))
+        self.assertEqual(len(calls), 2)
+
+        # While another worker holds the lock, expired entries are served
+        # stale instead of calling the handler again
+        key = resource.get_response_cache_key(request)
+        entry = cache.get(key)
+        entry['expires'] = time.time() - 1
+        cache.set(key, entry)
+        cache.add(key + ':lock', 1)
+
+        response = resource(self.factory.get('/cached/'))
+        self.assertEqual(response.content, first.content)
+        self.assertEqual(len(calls), 2)
+
+        # Without a stale entry, the request waits for the lock to time out
+        cache.delete(key)
+        response = resource(self.factory.get('/cached/'))
+        self.assertEqual(len(calls), 3)
+
+        # The lock is released by the worker computing the entry
+        cache.delete(key + ':lock')
+        cache.delete(key)
+        resource(self.factory.get('/cached/'))
+        self.assertEqual(len(calls), 4)
+        self.assertFalse(key + ':lock' in cache)
+
+    def test_response_cache_stale(self):
+        "Stale entries are served while revalidating and on errors."
+        import time
+        from django.core.cache import cache
+
+        calls = []
+
+        class StaleResource(Resource):
+            cache_responses = True
+            cache_max_age = 60
+            stale_while_revalidate = 30
+            stale_if_error = 300
+
+            def get(self, request):
+                calls.append(request)
+                if len(calls) == 3:
+                    raise ValueError
+                return {'count': len(calls)}
+
+        def expire(seconds):
+            entry = cache.get(key)
+            entry['expires'] = time.time() - seconds
+            cache.set(key, entry)
+
+        resource = StaleResource()
+        request = self.factory.get('/stale/')
+        response = resource(request)
+        key = resource.get_response_cache_key(request)
+        self.assertEqual(
+            sorted(response['Cache-Control'].split(', ')),
+            ['max-age=60', 'stale-if-error=300', 'stale-while-revalidate=30'])
+
+        # The stale entry is served and refreshed in the background with a
+        # copy of the request
+        expire(10)
+        request = self.factory.get('/stale/')
+        response = resource(request)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'count': 1})
+
+        for _ in range(20):
+            if cache.get(key)['expires'] > time.time():
+                break
+            time.sleep(0.05)
+
+        response = resource(self.factory.get('/stale/'))
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'count': 2})
+        self.assertFalse(calls[1] is request)
+        self.assertEqual(calls[1].get_full_path(), '/stale/')
+
+        # Beyond the revalidate window the handler is called, but the stale
+        # entry is served since it fails
+        expire(100)
+        response = resource(self.factory.get('/stale/'))
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'count': 2})
+        self.assertEqual(len(calls), 3)
+
+    def test_cache_dependencies(self):
+        "Model changes invalidate cached responses and ETags."
+        from .models import Library, Tag
+
+        calls = []
+
+        class LibraryResource(Resource):
+            use_etags = True
+            cache_responses = True
+            cache_max_age = 60 * 60
+            cache_dependencies = (Library, Tag)
+
+            def get(self, request):
+                calls.append(1)
+                return [{
+                    'name': library.name,
+                    'tags': [tag.name for tag in library.tags.all()],
+                } for library in Library.objects.order_by('pk')]
+
+        resource = LibraryResource()
+
+        etag = resource(self.factory.get('/libraries/'))['ETag']
+        resource(self.factory.get('/libraries/'))
+        self.assertEqual(len(calls), 1)
+
+        request = self.factory.get('/libraries/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resource(request).status_code, codes.not_modified)
+
+        library = Library.objects.create(name='restlib2', language='python')
+        response = resource(self.factory.get('/libraries/'))
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(b'restlib2' in response.content)
+
+        request = self.factory.get('/libraries/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resource(request).status_code, codes.ok)
+
+        # Relationship changes are tracked as well
+        library.tags.add(Tag.objects.create(name='rest'))
+        response = resource(self.factory.get('/libraries/'))
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(b'"rest"' in response.content)
+
+        library.delete()
+        resource(self.factory.get('/libraries/'))
+        self.assertEqual(len(calls), 4)
+
+    def test_tracked_last_modified(self):
+        "Last-Modified is derived from tracked model changes."
+        import time
+        from django.core.cache import cache
+        from restlib2 import dependencies
+        from .models import Tag
+
+        calls = []
+
+        class TagResource(Resource):
+            use_last_modified = True
+            cache_dependencies = (Tag,)
+
+            def get(self, request):
+                calls.append(1)
+                return [tag.name for tag in Tag.objects.all()]
+
+        resource = TagResource()
+
+        last_modified = resource(self.factory.get('/'))['Last-Modified']
+        request = self.factory.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(resource(request).status_code, codes.not_modified)
+        self.assertEqual(len(calls), 1)
+
+        Tag.objects.create(name='http')
+        tag = dependencies.model_tag(Tag)
+        self.assertTrue(cache.get(dependencies.MODIFIED_KEY.format(tag)) >=
+                        int(time.time()))
+
+        # Mimic the change happening a few seconds later
+        cache.set(dependencies.MODIFIED_KEY.format(tag), time.time() + 5)
+        request = self.factory.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_etag_lists(self):
+        "Lists of ETags, weak ETags and wildcards are supported."
+        class EtagResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return {}
+
+            def put(self, request):
+                pass
+
+        resource = EtagResource()
+        etag = resource(self.factory.get('/'))['ETag']
+
+        for value in ('"abc", ' + etag, '"abc", W/' + etag, '*'):
+            request = self.factory.get('/', HTTP_IF_NONE_MATCH=value)
+            response = resource(request)
+            self.assertEqual(response.status_code, codes.not_modified)
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"abc", "def"')
+        self.assertEqual(resource(request).status_code, codes.ok)
+
+        # Weak ETags never match for If-Match
+        for value, status in ((etag, codes.no_content),
+                              ('W/' + etag, codes.precondition_failed),
+                              ('"abc", ' + etag, codes.no_content),
+                              ('*', codes.no_content)):
+            request = generic_request(self.factory, 'PUT', '/',
+                                      HTTP_IF_MATCH=value)
+            self.assertEqual(resource(request).status_code, status)
+
+    def test_get_etag_override(self):
+        "Overridden get_etag validates the ETags sent by the client."
+        class EtagResource(Resource):
+            use_etags = True
+
+            def get(self, request):
+                return {}
+
+            def put(self, request):
+                pass
+
+            def get_etag(self, request, response, etag=None, *args,
+                         **kwargs):
+                if etag == 'v1':
+                    return etag
+
+        resource = EtagResource()
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"v0", "v1"')
+        self.assertEqual(resource(request).status_code, codes.not_modified)
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"v0"')
+        self.assertEqual(resource(request).status_code, codes.ok)
+
+        for value, status in (('"v1"', codes.no_content),
+                              ('"v0"', codes.precondition_failed)):
+            request = generic_request(self.factory, 'PUT', '/',
+                                      HTTP_IF_MATCH=value)
+            self.assertEqual(resource(request).status_code, status)
+
+    def test_ranges(self):
+        "Byte ranges of the representation can be requested."
+        class RangeResource(Resource):
+            use_etags = True
+            use_ranges = True
+            supported_accept_types = ('text/plain',)
+
+            def get(self, request):
+                return 'abcdefghij'
+
+        resource = RangeResource()
+
+        response = resource(self.factory.get('/'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        etag = response['ETag']
+
+        for value, content, content_range in (
+                ('bytes=0-3', b'abcd', 'bytes 0-3/10'),
+                ('bytes=8-', b'ij', 'bytes 8-9/10'),
+                ('bytes=-3', b'hij', 'bytes 7-9/10'),
+                ('bytes=5-100', b'fghij', 'bytes 5-9/10')):
+            response = resource(self.factory.get('/', HTTP_RANGE=value))
+            self.assertEqual(response.status_code, codes.partial_content)
+            self.assertEqual(response.content, content)
+            self.assertEqual(response['Content-Range'], content_range)
+
+        response = resource(self.factory.get('/', HTTP_RANGE='bytes=0-1,4-5'))
+        self.assertEqual(response.status_code, codes.partial_content)
+        content_type, boundary = response['Content-Type'].split('; ')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        self.assertTrue(b'Content-Range: bytes 0-1/10\r\n\r\nab' in
+                        response.content)
+        self.assertTrue(b'Content-Range: bytes 4-5/10\r\n\r\nef' in
+                        response.content)
+
+        response = resource(self.factory.get('/', HTTP_RANGE='bytes=20-'))
+        self.assertEqual(response.status_code,
+                         codes.requested_range_not_satisfiable)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        # The full representation is returned if it has changed
+        for value, status in ((etag, codes.partial_content),
+                              ('"abc"', codes.ok),
+                              ('W/' + etag, codes.ok)):
+            request = self.factory.get('/', HTTP_RANGE='bytes=0-3',
+                                       HTTP_IF_RANGE=value)
+            self.assertEqual(resource(request).status_code, status)
+
+    def test_file_ranges(self):
+        "Only the requested ranges are read from files."
+        import io
+
+        reads = []
+
+        class File(io.BytesIO):
+            def read(self, *args):
+                data = super(File, self).read(*args)
+                reads.append(len(data))
+                return data
+
+        class FileResource(Resource):
+            use_etags = True
+            use_ranges = True
+
+            def get(self, request):
+                return File(b'x' * 1000)
+
+            def calculate_etag(self, request):
+                return 'v1'
+
+        request = self.factory.get('/', HTTP_RANGE='bytes=100-199')
+        response = FileResource()(request)
+        self.assertEqual(response.status_code, codes.partial_content)
+        self.assertEqual(response.content, b'x' * 100)
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(reads, [100])
+
+    @skipIf(StreamingHttpResponse is None, 'Requires Django 1.5+')
+    def test_file_response(self):
+        "Files are streamed with validators derived from the file status."
+        import os
+        import tempfile
+        from django.utils.http import http_date
+
+        handle, path = tempfile.mkstemp()
+        os.write(handle, b'x' * 1000)
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        class FileResource(Resource):
+            use_etags = True
+            use_last_modified = True
+
+            def get(self, request):
+                return open(path, 'rb')
+
+        resource = FileResource()
+        stat = os.stat(path)
+
+        response = resource(self.factory.get('/'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], '1000')
+        self.assertEqual(response['ETag'],
+                         '"{0}"'.format(resource.get_file_etag(None, stat)))
+        self.assertTrue('Last-Modified' in response)
+        self.assertEqual(b''.join(response.streaming_content), b'x' * 1000)
+        response.close()
+        self.assertTrue(response.file_to_stream.closed)
+
+        request = self.factory.head('/')
+        response = resource(request)
+        self.assertEqual(response['Content-Length'], '1000')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        response.close()
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.not_modified)
+
+        # The modification time of the file validates If-Modified-Since
+        yesterday = stat.st_mtime - 60 * 60 * 24
+        os.utime(path, (yesterday, yesterday))
+
+        response = resource(self.factory.get('/'))
+        last_modified = response['Last-Modified']
+        self.assertEqual(last_modified, http_date(int(yesterday)))
+        response.close()
+
+        request = self.factory.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        response = resource(request)
+        self.assertEqual(response.status_code, codes.not_modified)
+        self.assertEqual(response.content, b'')
+
     def test_cache_control_default(self):
         class CacheableResource(Resource):
             def get(self, request):
@@ -469,8 +1596,26 @@ class TestResource(TemplateResponseMixin, Resource):
         pass
 
 
+class EchoResource(Resource):
+    use_etags = True
+
+    def get(self, request, pk):
+        return {'id': int(pk)}
+
+    def post(self, request, pk):
+        return request.data
+
+
+class ErrorResource(Resource):
+    def get(self, request):
+        raise ValueError('Resource failed')
+
+
 urlpatterns = patterns('',
-                       url(r'^$', TestResource(template_name='index.html')))
+                       url(r'^$', TestResource(template_name='index.html')),
+                       url(r'^echo/(?P<pk>\d+)/$', EchoResource()),
+                       url(r'^error/$', ErrorResource()),
+                       url(r'^batch/$', BatchResource()))
 
 
 class TemplateResourceTestCase(TestCase):
@@ -498,6 +1643,239 @@ class TemplateResourceTestCase(TestCase):
         self.assertEqual(response.content, b'<h1>Hello from testserver</h1>\n')
 
 
+class BatchResourceTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.resource = BatchResource()
+
+    def batch(self, items):
+        request = self.factory.post('/batch/', data=json.dumps(items),
+                                    content_type='application/json')
+        response = self.resource(request)
+        self.assertEqual(response.status_code, codes.ok)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_dispatch(self):
+        results = self.batch([
+            {'path': '/echo/1/'},
+            {'path': '/echo/2/', 'method': 'POST', 'body': {'foo': 1}},
+            {'path': '/missing/'},
+            {'path': '/batch/'},
+        ])
+
+        self.assertEqual([r['status'] for r in results], [200, 200, 404, 404])
+        self.assertEqual(results[0]['body'], {'id': 1})
+        self.assertEqual(results[1]['body'], {'foo': 1})
+        self.assertTrue('ETag' in results[0]['headers'])
+
+    def test_concurrency(self):
+        self.resource = BatchResource(max_concurrency=4)
+        results = self.batch([{'path': '/echo/{0}/'.format(i)}
+                              for i in range(10)])
+        self.assertEqual([r['body']['id'] for r in results], list(range(10)))
+
+    def test_conditional(self):
+        etag = self.batch([{'path': '/echo/1/'}])[0]['headers']['ETag']
+
+        results = self.batch([
+            {'path': '/echo/1/', 'headers': {'If-None-Match': etag}},
+            {'path': '/echo/2/', 'headers': {'If-None-Match': etag}},
+        ])
+
+        self.assertEqual(results[0]['status'], codes.not_modified)
+        self.assertEqual(results[0]['body'], None)
+        self.assertEqual(results[1]['status'], codes.ok)
+
+    def test_errors(self):
+        "Failing sub-requests do not fail the batch."
+        results = self.batch([
+            {'path': '/echo/1/', 'method': 'POST', 'body': 'hello'},
+            {'path': '/error/'},
+            {'path': '/echo/2/'},
+        ])
+
+        self.assertEqual([r['status'] for r in results],
+                         [codes.unsupported_media_type,
+                          codes.internal_server_error, codes.ok])
+
+    def test_binary(self):
+        import base64
+        from django.http import HttpResponse
+
+        request = self.factory.get('/files/1/')
+        response = HttpResponse(b'\x89PNG\xff\x00',
+                                content_type='application/octet-stream')
+        item = self.resource.encode_subresponse(request, response)
+
+        self.assertEqual(item['encoding'], 'base64')
+        self.assertEqual(base64.b64decode(item['body']), b'\x89PNG\xff\x00')
+        json.dumps(item)
+
+    def test_invalid(self):
+        request = self.factory.post('/batch/', data='[{"method": "GET"}]',
+                                    content_type='application/json')
+        response = self.resource(request)
+        self.assertEqual(response.status_code, codes.unprocessable_entity)
+
+        resource = BatchResource(max_batch_size=1)
+        request = self.factory.post('/batch/', data='[{}, {}]',
+                                    content_type='application/json')
+        response = resource(request)
+        self.assertEqual(response.status_code,
+                         codes.request_entity_too_large)
+
+
+class UploadResourceTestCase(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        self.factory = RequestFactory()
+        self.completed = completed = []
+
+        class Resource(UploadResource):
+            spool_dir = tempfile.mkdtemp()
+            max_upload_length = 100
+
+            def upload_complete(self, request, upload):
+                with upload.open() as f:
+                    completed.append((f.read(), upload.metadata))
+
+        self.resource = Resource()
+        self.addCleanup(shutil.rmtree, Resource.spool_dir)
+
+    def create(self, length, **headers):
+        request = generic_request(self.factory, 'POST', '/uploads/',
+                                  HTTP_UPLOAD_LENGTH=length, **headers)
+        return self.resource(request)
+
+    def append(self, upload_id, offset, data):
+        request = generic_request(
+            self.factory, 'PATCH', '/uploads/{0}/'.format(upload_id), data,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=offset)
+        return self.resource(request, upload_id=upload_id)
+
+    def test_upload(self):
+        response = self.create(10, HTTP_UPLOAD_METADATA='name Zm9v')
+        self.assertEqual(response.status_code, codes.created)
+        self.assertEqual(response['Tus-Resumable'], '1.0.0')
+        upload_id = response['Location'].rstrip('/').split('/')[-1]
+
+        response = self.append(upload_id, 0, b'x' * 4)
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(self.completed, [])
+
+        # Resuming from the wrong offset
+        response = self.append(upload_id, 2, b'y' * 6)
+        self.assertEqual(response.status_code, codes.conflict)
+
+        request = self.factory.head('/uploads/{0}/'.format(upload_id))
+        response = self.resource(request, upload_id=upload_id)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(response['Upload-Length'], '10')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        response = self.append(upload_id, 4, b'y' * 6)
+        self.assertEqual(response['Upload-Offset'], '10')
+        self.assertEqual(self.completed,
+                         [(b'xxxxyyyyyy', {'name': b'foo'})])
+
+        # Retrying the final request does not complete the upload again
+        response = self.append(upload_id, 10, b'')
+        self.assertEqual(response.status_code, codes.no_content)
+        self.assertEqual(len(self.completed), 1)
+
+        request = self.factory.get('/uploads/{0}/'.format(upload_id))
+        response = self.resource(request, upload_id=upload_id)
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'offset': 10, 'length': 10})
+
+        # Empty uploads are complete once created
+        self.create(0)
+        self.assertEqual(self.completed[-1], (b'', {}))
+
+    def test_invalid(self):
+        response = self.create('')
+        self.assertEqual(response.status_code, codes.bad_request)
+
+        response = self.create(1000)
+        self.assertEqual(response.status_code, codes.request_entity_too_large)
+
+        upload_id = self.create(2)['Location'].rstrip('/').split('/')[-1]
+        response = self.append(upload_id, 0, b'abc')
+        self.assertEqual(response.status_code, codes.request_entity_too_large)
+        self.assertEqual(response['Upload-Offset'], '2')
+
+        response = self.append('0' * 32, 0, b'abc')
+        self.assertEqual(response.status_code, codes.not_found)
+
+        request = self.factory.delete('/uploads/{0}/'.format(upload_id))
+        response = self.resource(request, upload_id=upload_id)
+        self.assertEqual(response.status_code, codes.no_content)
+
+        response = self.append(upload_id, 0, b'a')
+        self.assertEqual(response.status_code, codes.not_found)
+
+
+class PatchTestCase(TestCase):
+    def test_json_patch(self):
+        document = {'a': {'b': [1, 2]}, 'c': True, 'd/e': 'x'}
+
+        result, fields = patch.apply_json_patch(document, [
+            {'op': 'replace', 'path': '/a/b/0', 'value': 3},
+            {'op': 'move', 'from': '/d~1e', 'path': '/f'},
+            {'op': 'copy', 'from': '/a', 'path': '/g'},
+            {'op': 'remove', 'path': '/a/b/1'},
+            {'op': 'test', 'path': '/c', 'value': True},
+        ])
+
+        self.assertTrue(result is document)
+        self.assertEqual(document, {'a': {'b': [3]}, 'c': True, 'f': 'x',
+                                    'g': {'b': [3, 2]}})
+        self.assertEqual(fields, set(['a', 'd/e', 'f', 'g']))
+
+        # Booleans and numbers are distinct
+        self.assertRaises(patch.PatchConflict, patch.apply_json_patch,
+                          document, [{'op': 'test', 'path': '/c',
+                                      'value': 1}])
+
+        self.assertRaises(patch.PatchError, patch.apply_json_patch,
+                          document, [{'op': 'add', 'path': '/a/b/5',
+                                      'value': 1}])
+
+    def test_diff(self):
+        import copy
+
+        source = {'a': [1, 2, 3, 4], 'b': {'c': 1}, 'd/~': 1}
+        target = {'a': [0, 1, 2, 3, 4], 'b': {'c': 2}, 'e': None}
+
+        operations = patch.diff(source, target)
+        self.assertEqual(operations, [
+            {'op': 'remove', 'path': '/d~1~0'},
+            {'op': 'add', 'path': '/a/0', 'value': 0},
+            {'op': 'replace', 'path': '/b/c', 'value': 2},
+            {'op': 'add', 'path': '/e', 'value': None},
+        ])
+
+        result = patch.apply_json_patch(copy.deepcopy(source), operations)[0]
+        self.assertEqual(result, target)
+        self.assertEqual(patch.diff(source, source), [])
+
+    def test_merge_patch(self):
+        document = {'a': {'b': 1, 'c': 2}, 'd': [1]}
+
+        result, fields = patch.apply_merge_patch(document, {
+            'a': {'b': None, 'e': 3}, 'd': [2]})
+
+        self.assertTrue(result is document)
+        self.assertEqual(document, {'a': {'c': 2, 'e': 3}, 'd': [2]})
+        self.assertEqual(fields, set(['a', 'd']))
+
+
 class ParametizerTestCase(TestCase):
     def test_base(self):
         p = params.Parametizer()